@@ -10,11 +10,8 @@ from tools.Actions import Actions, is_valid_action
 from tools.utils import (
     count_matches,
     count_radiology_modality_and_organ_matches,
-    REGION_EXACT_DICT,
-    REGION_SUBSTR_DICT,
-    MODALITY_EXACT_DICT,
-    MODALITY_SUBSTR_DICT,
-    MODALITY_SPECIAL_CASES_DICT,
+    MODALITY_MATCHER,
+    REGION_MATCHER,
     UNIQUE_MODALITY_TO_ORGAN_MAPPING,
 )
 from agents.AgentAction import AgentAction
@@ -154,17 +151,8 @@ class DiagnosisWorkflowParser(AgentOutputParser):
             # action_keywords = extract_keywords_spacy(action)
 
             # Check if imaging modality is directly given as action
-            modality_counts = count_matches(
-                self.action,
-                exact_dict=MODALITY_EXACT_DICT,
-                substr_dict=MODALITY_SUBSTR_DICT,
-                special_cases_dict=MODALITY_SPECIAL_CASES_DICT,
-            )
-            organ_counts = count_matches(
-                self.action,
-                exact_dict=REGION_EXACT_DICT,
-                substr_dict=REGION_SUBSTR_DICT,
-            )
+            modality_counts = MODALITY_MATCHER.count(self.action)
+            organ_counts = REGION_MATCHER.count(self.action)
 
             # Valid imaging keywords should make up more than 25% of the action keywords or else it is likely a false positive
             if sum(modality_counts.values()) + sum(organ_counts.values()) > 0.25 * len(
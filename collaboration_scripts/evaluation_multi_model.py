@@ -14,6 +14,7 @@ import string
 from negspacy.negation import Negex
 from thefuzz import fuzz
 from utils.nlp import keyword_positive, remove_punctuation
+from utils.results_store import ResultsStore
 
 
 nlp = spacy.load("en_core_sci_lg")
@@ -133,17 +134,9 @@ def map_pathology_name(
     return extracted_diagnosis
 
 
-def read_from_pickle_file(filename):
-    with open(filename, "rb") as f:
-        while True:
-            try: yield pickle.load(f)
-            except EOFError: break
-
-
 def load_data_from_pkl(path: str) -> dict:
     file_path = glob.glob(path)[0]
-    results_list = [r for r in read_from_pickle_file(file_path)]
-    return {k: v for d in results_list for k, v in d.items()}
+    return ResultsStore(file_path).load_all()
 
 
 class DiagnosisComparator:
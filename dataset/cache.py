@@ -0,0 +1,83 @@
+import json
+import os
+from os.path import join, exists
+
+import pandas as pd
+
+# Increase when the way a table is built in load_data changes so that existing caches are rebuilt
+CACHE_VERSION = 1
+
+
+def source_signature(sources):
+    """
+    Describe the source files of a cached table. A cached table is only valid as long as the signature of its sources is unchanged.
+
+    Args:
+        sources (List[str]): Paths of the csv files the table is built from
+
+    Returns:
+        signature (Dict): Cache version and modification time and size of every source file
+    """
+    return {
+        "version": CACHE_VERSION,
+        "sources": [
+            {
+                "path": os.path.abspath(source),
+                "mtime": os.path.getmtime(source),
+                "size": os.path.getsize(source),
+            }
+            for source in sources
+        ],
+    }
+
+
+# Parquet needs one type per column. Object columns that pandas parsed partly as numbers and partly as strings are converted to strings. This is done with and without cache so that both return the same tables
+def make_parquet_safe(df):
+    for column in df.columns:
+        if df[column].dtype == object and pd.api.types.infer_dtype(
+            df[column], skipna=True
+        ).startswith("mixed"):
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return df
+
+
+def load_cached_table(cache_dir, name, sources, build, columns=None):
+    """
+    Load a table from the parquet cache or build it from its sources and write it to the cache.
+
+    Args:
+        cache_dir (str): Directory holding the cached tables. If None the table is always built and not cached
+        name (str): Name of the table
+        sources (List[str]): Paths of the csv files the table is built from
+        build (Callable): Builds the table from the sources if the cache is missing or outdated
+        columns (List[str]): Only load these columns. All columns if None
+
+    Returns:
+        df (pd.DataFrame): The table
+    """
+    if not cache_dir:
+        df = make_parquet_safe(build())
+        return df if columns is None else df[columns]
+
+    table_path = join(cache_dir, f"{name}.parquet")
+    signature_path = join(cache_dir, f"{name}.json")
+    signature = source_signature(sources)
+
+    if exists(table_path) and exists(signature_path):
+        with open(signature_path, "r") as f:
+            if json.load(f) == signature:
+                return pd.read_parquet(table_path, columns=columns)
+
+    print(f"Building cache of {name}")
+    df = make_parquet_safe(build())
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to temporary files first so that an interrupted write never leaves a valid looking cache behind
+    df.to_parquet(table_path + ".tmp")
+    os.replace(table_path + ".tmp", table_path)
+    with open(signature_path + ".tmp", "w") as f:
+        json.dump(signature, f)
+    os.replace(signature_path + ".tmp", signature_path)
+
+    if columns is not None:
+        df = df[columns]
+    return df
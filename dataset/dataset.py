@@ -3,8 +3,10 @@ from os.path import join
 import re
 import traceback
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
 
+import numpy as np
 import pandas as pd
 
 from dataset.discharge import (
@@ -17,10 +19,11 @@ from dataset.radiology import (
     extract_rad_events,
     sanitize_rad,
 )
-from dataset.labs import parse_lab_events, parse_microbio
+from dataset.labs import parse_lab_events_group, parse_microbio_group
 from dataset.procedures import extract_procedures
 from dataset.diagnosis import extract_diagnosis_from_diag_df
 from dataset.utils import write_hadm_to_file, print_value_counts
+from dataset.cache import load_cached_table
 from tools.utils import count_radiology_modality_and_organ_matches
 
 
@@ -126,6 +129,7 @@ def extract_info(
     radiology_report_details_df,
     diag_df,
     procedures_df,
+    num_workers=1,
 ):
     # Extract the discharge, history, pe, le and radiology report for hadm_ids
     hadm_info = extract_hadm_info(
@@ -137,6 +141,7 @@ def extract_info(
         microbiology_df,
         radiology_report_df,
         radiology_report_details_df,
+        num_workers=num_workers,
     )
     print("--")
 
@@ -232,91 +237,183 @@ def create_valuestr_microbio(row):
         return comment
 
 
-def load_data(base_mimic: str = ""):
-    base_hosp = join(base_mimic, "hosp")
-    base_notes = join(base_mimic, "note")
-
-    # Load admissions
-    admissions_df = pd.read_csv(join(base_hosp, "admissions.csv"))
+# Column-wise version of create_valuestr_lab. Gives the same strings without calling a python function for every row
+def create_valuestr_lab_column(lab_events_df):
+    valuenum = lab_events_df["valuenum"]
+    value = lab_events_df["value"]
+    valueuom = lab_events_df["valueuom"]
+    flag = lab_events_df["flag"]
 
-    # Load transfers
-    transfers_df = pd.read_csv(join(base_mimic, "hosp", "transfers.csv"))
+    # Same order of preference as row-wise: valuenum, value, flag and finally comments
+    use_valuenum = valuenum.notna() & (valuenum != "___")
+    use_value = ~use_valuenum & value.notna() & (value != "___")
+    use_flag = ~use_valuenum & ~use_value & flag.notna()
 
-    diagnoses_icd_df = pd.read_csv(join(base_hosp, "diagnoses_icd.csv"))
-    # remove NAN ICD Codes
-    diagnoses_icd_df = diagnoses_icd_df[~diagnoses_icd_df.icd_code.isna()]
+    valuestr = lab_events_df["comments"].astype(object)
+    valuestr = valuestr.mask(use_flag, flag)
+    for use, column in ((use_valuenum, valuenum), (use_value, value)):
+        strings = column[use].astype(str)
+        uom = valueuom[use]
+        # If units of measurement is not NaN, include
+        valuestr.loc[use] = strings.where(uom.isna(), strings + " " + uom)
+    return valuestr
+
+
+# Column-wise version of create_valuestr_microbio
+def create_valuestr_microbio_column(microbiology_df):
+    org_name = microbiology_df["org_name"]
+    return org_name.where(org_name.notna(), microbiology_df["comments"])
+
+
+# Columns used when extracting the hadm_info. Pass as columns to load_data to skip loading the rest of the big tables
+EXTRACTION_COLUMNS = {
+    "transfers": ["subject_id", "hadm_id", "intime"],
+    "discharge": ["subject_id", "hadm_id", "text"],
+    "radiology": ["note_id", "subject_id", "hadm_id", "charttime", "text"],
+    "radiology_detail": ["note_id", "field_name", "field_value", "field_ordinal"],
+    "labevents": [
+        "subject_id",
+        "hadm_id",
+        "itemid",
+        "charttime",
+        "valuestr",
+        "ref_range_lower",
+        "ref_range_upper",
+        "label",
+    ],
+    "microbiologyevents": [
+        "subject_id",
+        "hadm_id",
+        "charttime",
+        "spec_itemid",
+        "test_itemid",
+        "org_itemid",
+        "valuestr",
+    ],
+}
+
+
+def load_data(base_mimic: str = "", cache_dir: str = None, columns: dict = None):
+    """
+    Load the MIMIC tables with descriptions merged in and datetimes parsed.
+
+    Args:
+        base_mimic (str): Base directory of MIMIC
+        cache_dir (str): If given, the prepared tables are cached as parquet files in this directory and only rebuilt from the csv files when these change
+        columns (Dict[str, List[str]]): Only load these columns of the given tables (i.e. EXTRACTION_COLUMNS)
+
+    Returns:
+        Tuple of admissions, transfers, diagnoses, procedures, discharge, radiology, radiology details, lab events and microbiology DataFrames
+    """
+    base_hosp = join(base_mimic, "hosp")
+    base_notes = join(base_mimic, "note")
+    columns = columns or {}
 
-    # ICD Descriptions
-    icd_descriptions = pd.read_csv(join(base_hosp, "d_icd_diagnoses.csv"))
+    def load_table(name, sources, build):
+        return load_cached_table(
+            cache_dir, name, sources, build, columns=columns.get(name)
+        )
 
-    # Expand to include names of disease, once for version 9 and once for version 10
-    diag_icd9 = diagnoses_icd_df[diagnoses_icd_df.icd_version == 9]
-    icd_descriptions_9 = icd_descriptions[icd_descriptions.icd_version == 9]
-    diag_icd9 = diag_icd9.merge(
-        icd_descriptions_9[["icd_code", "long_title"]], on="icd_code", how="left"
-    )
+    def build_admissions():
+        # Load admissions
+        admissions_df = pd.read_csv(join(base_hosp, "admissions.csv"))
+        admissions_df["admittime"] = pd.to_datetime(admissions_df["admittime"])
+        admissions_df["dischtime"] = pd.to_datetime(admissions_df["dischtime"])
+        return admissions_df
+
+    def build_transfers():
+        # Load transfers
+        transfers_df = pd.read_csv(join(base_mimic, "hosp", "transfers.csv"))
+        # Convert transfers to datetime
+        transfers_df["intime"] = pd.to_datetime(transfers_df["intime"])
+        return transfers_df
+
+    def build_diagnoses():
+        diagnoses_icd_df = pd.read_csv(join(base_hosp, "diagnoses_icd.csv"))
+        # remove NAN ICD Codes
+        diagnoses_icd_df = diagnoses_icd_df[~diagnoses_icd_df.icd_code.isna()]
+
+        # ICD Descriptions
+        icd_descriptions = pd.read_csv(join(base_hosp, "d_icd_diagnoses.csv"))
+
+        # Expand to include names of disease, once for version 9 and once for version 10
+        diag_icd9 = diagnoses_icd_df[diagnoses_icd_df.icd_version == 9]
+        icd_descriptions_9 = icd_descriptions[icd_descriptions.icd_version == 9]
+        diag_icd9 = diag_icd9.merge(
+            icd_descriptions_9[["icd_code", "long_title"]], on="icd_code", how="left"
+        )
 
-    diag_icd10 = diagnoses_icd_df[diagnoses_icd_df.icd_version == 10]
-    icd_descriptions_10 = icd_descriptions[icd_descriptions.icd_version == 10]
-    diag_icd10 = diag_icd10.merge(
-        icd_descriptions_10[["icd_code", "long_title"]], on="icd_code", how="left"
-    )
+        diag_icd10 = diagnoses_icd_df[diagnoses_icd_df.icd_version == 10]
+        icd_descriptions_10 = icd_descriptions[icd_descriptions.icd_version == 10]
+        diag_icd10 = diag_icd10.merge(
+            icd_descriptions_10[["icd_code", "long_title"]], on="icd_code", how="left"
+        )
 
-    diag_icd = pd.concat([diag_icd9, diag_icd10])
+        return pd.concat([diag_icd9, diag_icd10])
 
-    # Load procedures
-    procedures_df = pd.read_csv(join(base_hosp, "procedures_icd.csv"))
+    def build_procedures():
+        # Load procedures
+        procedures_df = pd.read_csv(join(base_hosp, "procedures_icd.csv"))
 
-    # Load description of procedures and merge
-    procedures_descr_df = pd.read_csv(join(base_hosp, "d_icd_procedures.csv"))
-    procedures_descr_9_df = procedures_descr_df[procedures_descr_df.icd_version == 9]
-    procedures_descr_10_df = procedures_descr_df[procedures_descr_df.icd_version == 10]
-    procedures_9_df = procedures_df[procedures_df.icd_version == 9]
-    procedures_10_df = procedures_df[procedures_df.icd_version == 10]
-    procedures_9_df = procedures_9_df.merge(
-        procedures_descr_9_df[["icd_code", "long_title"]], on="icd_code", how="left"
-    )
-    procedures_10_df = procedures_10_df.merge(
-        procedures_descr_10_df[["icd_code", "long_title"]], on="icd_code", how="left"
-    )
-    procedures_df = pd.concat([procedures_9_df, procedures_10_df])
+        # Load description of procedures and merge
+        procedures_descr_df = pd.read_csv(join(base_hosp, "d_icd_procedures.csv"))
+        procedures_descr_9_df = procedures_descr_df[
+            procedures_descr_df.icd_version == 9
+        ]
+        procedures_descr_10_df = procedures_descr_df[
+            procedures_descr_df.icd_version == 10
+        ]
+        procedures_9_df = procedures_df[procedures_df.icd_version == 9]
+        procedures_10_df = procedures_df[procedures_df.icd_version == 10]
+        procedures_9_df = procedures_9_df.merge(
+            procedures_descr_9_df[["icd_code", "long_title"]], on="icd_code", how="left"
+        )
+        procedures_10_df = procedures_10_df.merge(
+            procedures_descr_10_df[["icd_code", "long_title"]],
+            on="icd_code",
+            how="left",
+        )
+        return pd.concat([procedures_9_df, procedures_10_df])
 
-    # Load notes
-    discharge_df = pd.read_csv(join(base_notes, "discharge.csv"))
+    def build_radiology():
+        # Load radiology reports
+        radiology_report_df = pd.read_csv(join(base_notes, "radiology.csv"))
+        radiology_report_df["charttime"] = pd.to_datetime(
+            radiology_report_df["charttime"]
+        )
+        return radiology_report_df
 
-    # Load radiology reports
-    radiology_report_df = pd.read_csv(join(base_notes, "radiology.csv"))
+    def build_microbiology():
+        # Load microbiology events
+        microbiology_df = pd.read_csv(join(base_hosp, "microbiologyevents.csv"))
+        # Remove canceled tests
+        microbiology_df = microbiology_df[microbiology_df["org_itemid"] != 90760.0]
 
-    # Load radiology report details
-    radiology_report_details_df = pd.read_csv(join(base_notes, "radiology_detail.csv"))
+        # Create valuestr for microbio
+        microbiology_df["valuestr"] = create_valuestr_microbio_column(microbiology_df)
 
-    # Load microbiology events
-    microbiology_df = pd.read_csv(join(base_hosp, "microbiologyevents.csv"))
-    # Remove canceled tests
-    microbiology_df = microbiology_df[microbiology_df["org_itemid"] != 90760.0]
+        # Convert microbiology charttime to datetime
+        microbiology_df["charttime"] = pd.to_datetime(microbiology_df["charttime"])
+        return microbiology_df
 
-    # Load lab events
-    lab_events_df = pd.read_csv(join(base_hosp, "labevents.csv"))
+    def build_lab_events():
+        # Load lab events
+        lab_events_df = pd.read_csv(join(base_hosp, "labevents.csv"))
 
-    # Load lab event descriptions
-    lab_events_descr_df = pd.read_csv(join(base_hosp, "d_labitems.csv"))
+        # Load lab event descriptions
+        lab_events_descr_df = pd.read_csv(join(base_hosp, "d_labitems.csv"))
 
-    # Expand lab events to include descriptions
-    lab_events_df = lab_events_df.merge(
-        lab_events_descr_df[["itemid", "label"]], on="itemid", how="left"
-    )
+        # Expand lab events to include descriptions
+        lab_events_df = lab_events_df.merge(
+            lab_events_descr_df[["itemid", "label"]], on="itemid", how="left"
+        )
 
-    # Create valuestr from valuenum and valueuom
-    lab_events_df["valuestr"] = lab_events_df.apply(
-        lambda row: create_valuestr_lab(row),
-        axis=1,
-    )
+        # Create valuestr from valuenum and valueuom
+        lab_events_df["valuestr"] = create_valuestr_lab_column(lab_events_df)
 
-    # Create valuestr for microbio
-    microbiology_df["valuestr"] = microbiology_df.apply(
-        lambda row: create_valuestr_microbio(row),
-        axis=1,
-    )
+        # Convert lab events charrtime to datetime
+        lab_events_df["charttime"] = pd.to_datetime(lab_events_df["charttime"])
+        return lab_events_df
 
     # Many lab events dont have a hadm_id. If a patient only has one hadm_id we can fill that in for them
     # get all patients with only one hadm_id
@@ -351,12 +448,50 @@ def load_data(base_mimic: str = ""):
     # )
     # microbiology_df = microbiology_df.drop(columns=["hadm_id_x", "hadm_id_y"])
 
-    # Convert transfers to datetime
-    transfers_df["intime"] = pd.to_datetime(transfers_df["intime"])
-    # Convert lab events charrtime to datetime
-    lab_events_df["charttime"] = pd.to_datetime(lab_events_df["charttime"])
-    # Convert microbiology charttime to datetime
-    microbiology_df["charttime"] = pd.to_datetime(microbiology_df["charttime"])
+    admissions_df = load_table(
+        "admissions", [join(base_hosp, "admissions.csv")], build_admissions
+    )
+    transfers_df = load_table(
+        "transfers", [join(base_hosp, "transfers.csv")], build_transfers
+    )
+    diag_icd = load_table(
+        "diagnoses_icd",
+        [join(base_hosp, "diagnoses_icd.csv"), join(base_hosp, "d_icd_diagnoses.csv")],
+        build_diagnoses,
+    )
+    procedures_df = load_table(
+        "procedures_icd",
+        [
+            join(base_hosp, "procedures_icd.csv"),
+            join(base_hosp, "d_icd_procedures.csv"),
+        ],
+        build_procedures,
+    )
+    # Load notes
+    discharge_df = load_table(
+        "discharge",
+        [join(base_notes, "discharge.csv")],
+        lambda: pd.read_csv(join(base_notes, "discharge.csv")),
+    )
+    radiology_report_df = load_table(
+        "radiology", [join(base_notes, "radiology.csv")], build_radiology
+    )
+    # Load radiology report details
+    radiology_report_details_df = load_table(
+        "radiology_detail",
+        [join(base_notes, "radiology_detail.csv")],
+        lambda: pd.read_csv(join(base_notes, "radiology_detail.csv")),
+    )
+    microbiology_df = load_table(
+        "microbiologyevents",
+        [join(base_hosp, "microbiologyevents.csv")],
+        build_microbiology,
+    )
+    lab_events_df = load_table(
+        "labevents",
+        [join(base_hosp, "labevents.csv"), join(base_hosp, "d_labitems.csv")],
+        build_lab_events,
+    )
 
     return (
         admissions_df,
@@ -379,38 +514,124 @@ def fill_nan_hadm(
     transfers_df,
     hadm_to_subject_id,
 ):
-    for _id in disease_ids:
-        s_id = hadm_to_subject_id[_id]
+    # Window of every admission from a day before the first transfer until the last transfer
+    disease_ids = list(dict.fromkeys(disease_ids))
+    time_data = transfers_df[transfers_df["hadm_id"].isin(disease_ids)].sort_values(
+        "intime", kind="stable"
+    )
+    start_times = time_data.drop_duplicates("hadm_id", keep="first").set_index(
+        "hadm_id"
+    )["intime"]
+    end_times = time_data.drop_duplicates("hadm_id", keep="last").set_index(
+        "hadm_id"
+    )["intime"]
+    windows = pd.DataFrame(
+        {
+            "window_hadm_id": disease_ids,
+            "subject_id": [hadm_to_subject_id[_id] for _id in disease_ids],
+            # Events inside the windows of multiple admissions go to the admission that comes first in disease_ids
+            "priority": range(len(disease_ids)),
+        }
+    )
+    windows["start_time"] = (
+        windows["window_hadm_id"].map(start_times) - timedelta(days=1)
+    ).values
+    windows["end_time"] = windows["window_hadm_id"].map(end_times).values
+    windows = windows.dropna(subset=["start_time", "end_time"])
+
+    def fill(events_df):
+        # Join all events without hadm_id to the windows of their subject in one go
+        positions = np.flatnonzero(events_df["hadm_id"].isna().values)
+        nan_events = pd.DataFrame(
+            {
+                "position": positions,
+                "subject_id": events_df["subject_id"].values[positions],
+                "charttime": events_df["charttime"].values[positions],
+            }
+        )
+        matches = nan_events.merge(windows, on="subject_id")
+        matches = matches[
+            (matches["charttime"] >= matches["start_time"])
+            & (matches["charttime"] <= matches["end_time"])
+        ]
+        matches = matches.sort_values("priority", kind="stable").drop_duplicates(
+            "position", keep="first"
+        )
+        events_df.iloc[
+            matches["position"].values, events_df.columns.get_loc("hadm_id")
+        ] = matches["window_hadm_id"].values
+        return events_df
+
+    return fill(lab_events_df), fill(radiology_reports_df), fill(microbiology_df)
+
+
+# Extract the hadm_info of a single admission from its discharge note and events. Runs in worker processes if extract_hadm_info uses multiple workers
+def extract_admission(
+    discharge_text,
+    lab_events,
+    microbiology_events,
+    radiology_texts,
+    note_ids,
+    note_names,
+):
+    history = extract_history(discharge_text)
 
-        time_data = transfers_df[transfers_df["hadm_id"] == _id].sort_values("intime")
-        start_time = pd.Timestamp(time_data["intime"].values[0])
-        end_time = pd.Timestamp(time_data["intime"].values[-1])
+    pe = extract_physical_examination(discharge_text)
 
-        mask_le = (
-            (lab_events_df["subject_id"] == s_id)
-            & (lab_events_df["charttime"] >= (start_time - timedelta(days=1)))
-            & (lab_events_df["charttime"] <= end_time)
-            & (lab_events_df["hadm_id"].isna())
-        )
-        lab_events_df.loc[mask_le, "hadm_id"] = _id
+    le, ref_r_low, ref_r_up = parse_lab_events_group(lab_events)
 
-        mask_rad = (
-            (radiology_reports_df["subject_id"] == s_id)
-            & (radiology_reports_df["charttime"] >= (start_time - timedelta(days=1)))
-            & (radiology_reports_df["charttime"] <= end_time)
-            & (radiology_reports_df["hadm_id"].isna())
-        )
-        radiology_reports_df.loc[mask_rad, "hadm_id"] = _id
+    microbio, microbio_spec = parse_microbio_group(microbiology_events)
+
+    rad = extract_rad_events(radiology_texts)
 
-        mask_micro = (
-            (microbiology_df["subject_id"] == s_id)
-            & (microbiology_df["charttime"] >= (start_time - timedelta(days=1)))
-            & (microbiology_df["charttime"] <= end_time)
-            & (microbiology_df["hadm_id"].isna())
+    rad_regions = []
+    rad_modalities = []
+    for exam_name in note_names:
+        # Count matches of each modality and region and get most frequent plus counts
+        (
+            frequent_modality,
+            frequent_modality_count,
+            frequent_region,
+            frequent_region_count,
+        ) = count_radiology_modality_and_organ_matches(exam_name)
+
+        if frequent_modality_count == 0:
+            frequent_modality = None
+        if frequent_region_count == 0:
+            frequent_region = None
+
+        rad_modalities.append(frequent_modality)
+        rad_regions.append(frequent_region)
+
+    rad_data = []
+    for i in range(len(rad)):
+        rad_data.append(
+            {
+                "Report": rad[i],
+                "Modality": rad_modalities[i],
+                "Region": rad_regions[i],
+                "Exam Name": note_names[i],
+                "Note ID": note_ids[i],
+            }
         )
-        microbiology_df.loc[mask_micro, "hadm_id"] = _id
 
-    return lab_events_df, radiology_reports_df, microbiology_df
+    return {
+        "Discharge": discharge_text,
+        "Patient History": history,
+        "Physical Examination": pe,
+        "Laboratory Tests": le,
+        "Microbiology": microbio,
+        "Microbiology Spec": microbio_spec,
+        "Reference Range Lower": ref_r_low,
+        "Reference Range Upper": ref_r_up,
+        "Radiology": rad_data,
+    }
+
+
+# Split a frame into the rows of each admission in a single pass. Only keeps the admissions in hadm_ids
+def group_by_hadm(df, hadm_ids):
+    df = df[df["hadm_id"].isin(hadm_ids)]
+    return dict(tuple(df.groupby("hadm_id", sort=False)))
 
 
 def extract_hadm_info(
@@ -422,6 +643,7 @@ def extract_hadm_info(
     microbiology_df,
     radiology_report_df,
     radiology_report_details_df,
+    num_workers=1,
 ):
     skipped = 0
     lab_events_df["charttime"] = pd.to_datetime(lab_events_df["charttime"])
@@ -532,8 +754,14 @@ def extract_hadm_info(
         hadm_to_subject_id,
     )
 
-    hadm_info = {}
+    # Split the events by admission once so that every admission only touches its own rows
+    lab_events_groups = group_by_hadm(lab_events_df_sf, disease_ids)
+    microbiology_groups = group_by_hadm(microbiology_df_sf, disease_ids)
+    radiology_report_groups = group_by_hadm(radiology_report_df_sf, disease_ids)
 
+    # Collect the inputs of every admission. The extraction itself is independent per admission
+    admission_ids = []
+    admission_inputs = []
     for _id in disease_ids:
         if _id in discharge_dict:
             discharge_row = discharge_dict[_id]
@@ -546,23 +774,10 @@ def extract_hadm_info(
             ):
                 continue
 
-            history = extract_history(discharge_text)
-
-            pe = extract_physical_examination(discharge_text)
-
-            le, ref_r_low, ref_r_up = parse_lab_events(lab_events_df_sf, _id)
-
-            microbio, microbio_spec = parse_microbio(microbiology_df_sf, _id)
-
-            rad = extract_rad_events(
-                radiology_report_df_sf[radiology_report_df_sf["hadm_id"] == _id][
-                    "text"
-                ].values
+            radiology_reports = radiology_report_groups.get(
+                _id, radiology_report_df_sf.iloc[:0]
             )
-
-            note_ids = radiology_report_df_sf[radiology_report_df_sf["hadm_id"] == _id][
-                "note_id"
-            ].values
+            note_ids = radiology_reports["note_id"].values
 
             note_names = []
             for note_id in note_ids:
@@ -580,50 +795,34 @@ def extract_hadm_info(
                         name = ""
                 note_names.append(name)
 
-            rad_regions = []
-            rad_modalities = []
-            for exam_name in note_names:
-                # Count matches of each modality and region and get most frequent plus counts
+            admission_ids.append(_id)
+            admission_inputs.append(
                 (
-                    frequent_modality,
-                    frequent_modality_count,
-                    frequent_region,
-                    frequent_region_count,
-                ) = count_radiology_modality_and_organ_matches(exam_name)
-
-                if frequent_modality_count == 0:
-                    frequent_modality = None
-                if frequent_region_count == 0:
-                    frequent_region = None
-
-                rad_modalities.append(frequent_modality)
-                rad_regions.append(frequent_region)
-
-            rad_data = []
-            for i in range(len(rad)):
-                rad_data.append(
-                    {
-                        "Report": rad[i],
-                        "Modality": rad_modalities[i],
-                        "Region": rad_regions[i],
-                        "Exam Name": note_names[i],
-                        "Note ID": note_ids[i],
-                    }
+                    discharge_text,
+                    lab_events_groups.get(_id, lab_events_df_sf.iloc[:0]),
+                    microbiology_groups.get(_id, microbiology_df_sf.iloc[:0]),
+                    radiology_reports["text"].values,
+                    note_ids,
+                    note_names,
                 )
-
-            hadm_info[_id] = {
-                "Discharge": discharge_text,
-                "Patient History": history,
-                "Physical Examination": pe,
-                "Laboratory Tests": le,
-                "Microbiology": microbio,
-                "Microbiology Spec": microbio_spec,
-                "Reference Range Lower": ref_r_low,
-                "Reference Range Upper": ref_r_up,
-                "Radiology": rad_data,
-            }
+            )
         else:
             skipped += 1
+
+    if num_workers > 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            # map returns the results in the order of the admissions
+            admissions = list(
+                executor.map(
+                    extract_admission,
+                    *zip(*admission_inputs),
+                    chunksize=max(1, len(admission_inputs) // (4 * num_workers)),
+                )
+            )
+    else:
+        admissions = [extract_admission(*inputs) for inputs in admission_inputs]
+
+    hadm_info = dict(zip(admission_ids, admissions))
     print("Skipped {} hadm_ids".format(skipped))
     return hadm_info
 
@@ -746,3 +945,50 @@ def sanitize_hadm_texts(hadm_info, disease_names):
         )
     )
     return hadm_info
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Extract the hadm_info of all admissions of a pathology"
+    )
+    parser.add_argument("--base_mimic", required=True)
+    parser.add_argument("--pathology", required=True)
+    # Names of the pathology that are removed from the patient texts. Defaults to the pathology itself
+    parser.add_argument("--sanitize", nargs="*")
+    parser.add_argument("--cache_dir")
+    # Number of processes extracting admissions in parallel
+    parser.add_argument("--num_workers", type=int, default=1)
+    args = parser.parse_args()
+
+    (
+        admissions_df,
+        transfers_df,
+        diag_icd,
+        procedures_df,
+        discharge_df,
+        radiology_report_df,
+        radiology_report_details_df,
+        lab_events_df,
+        microbiology_df,
+    ) = load_data(
+        args.base_mimic, cache_dir=args.cache_dir, columns=EXTRACTION_COLUMNS
+    )
+
+    hadm_ids = extract_hadm_ids(args.pathology, diag_icd, discharge_df)
+    extract_info(
+        hadm_ids,
+        args.pathology,
+        args.sanitize or [args.pathology],
+        discharge_df,
+        admissions_df,
+        transfers_df,
+        lab_events_df,
+        microbiology_df,
+        radiology_report_df,
+        radiology_report_details_df,
+        diag_icd,
+        procedures_df,
+        num_workers=args.num_workers,
+    )
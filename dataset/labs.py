@@ -13,7 +13,13 @@ from tools.utils import (
 
 
 def parse_lab_events(lab_events_df_sf, _id):
-    filtered_lab_events = lab_events_df_sf[lab_events_df_sf["hadm_id"] == _id]
+    return parse_lab_events_group(
+        lab_events_df_sf[lab_events_df_sf["hadm_id"] == _id]
+    )
+
+
+# Parse the lab events of a single admission
+def parse_lab_events_group(filtered_lab_events):
     le, ref_r_low, ref_r_up = {}, {}, {}
     if not filtered_lab_events.empty:
         sorted_df = filtered_lab_events.sort_values(by="charttime", ascending=True)
@@ -27,7 +33,11 @@ def parse_lab_events(lab_events_df_sf, _id):
 
 
 def parse_microbio(microbio_df_sf, _id):
-    filtered_microbio_df = microbio_df_sf[microbio_df_sf["hadm_id"] == _id]
+    return parse_microbio_group(microbio_df_sf[microbio_df_sf["hadm_id"] == _id])
+
+
+# Parse the microbiology events of a single admission
+def parse_microbio_group(filtered_microbio_df):
     microbio = {}
     microbio_spec = {}
 
@@ -1,11 +1,13 @@
 import os
 import pickle
 import glob
+from concurrent.futures import ProcessPoolExecutor
 
 import hydra
 
 from dataset.utils import load_hadm_from_file
-from utils.logging import read_from_pickle_file
+from utils.results_store import ResultsStore
+from utils.nlp import doc_cache_stats, get_nlp
 from evaluators.appendicitis_evaluator import AppendicitisEvaluator
 from evaluators.cholecystitis_evaluator import CholecystitisEvaluator
 from evaluators.diverticulitis_evaluator import DiverticulitisEvaluator
@@ -44,12 +46,57 @@ def load_evaluator(pathology):
     return evaluator
 
 
+# Loads the spaCy pipeline once per worker process instead of with the first patient of every batch
+def init_evaluation_worker():
+    get_nlp()
+
+
+def evaluate_patients(pathology, patients):
+    """
+    Score the diagnoses of a batch of patients of one pathology.
+
+    Args:
+        pathology (str): Pathology of the patients
+        patients (List[Tuple]): Id, diagnosis of the model and reference of every patient
+
+    Returns:
+        evals (List[Tuple]): Id and evaluation of every patient, in the order of patients
+        cache_stats (Tuple): Process id and parsed sentence cache statistics of the process
+    """
+    evals = []
+    evaluator = load_evaluator(pathology)
+    for _id, result, reference in patients:
+        evaluator.reset()
+        eval = evaluator._evaluate_agent_trajectory(
+            prediction=result,
+            input="",
+            reference=reference,
+            agent_trajectory=[],
+            diagnosis_probabilities=None,
+        )
+        evals.append((_id, eval))
+    return evals, (os.getpid(), doc_cache_stats())
+
+
+def merge_cache_stats(cache_stats):
+    # Statistics are cumulative per process so only the latest of every process counts
+    latest = {}
+    for pid, stats in cache_stats:
+        latest[pid] = stats
+    return {
+        field: sum(stats[field] for stats in latest.values())
+        for field in ["hits", "misses", "size"]
+    }
+
+
 @hydra.main(config_path="./configs", config_name="config", version_base=None)
 def evaluate(args):
     data_dir = args.data_dir
     print(args.run_name)
     result_dir = os.path.join(args.save_dir, args.run_name)
     difficulty = "dr_eval"
+    num_workers = getattr(args, "num_workers", 1) or 1
+    eval_batch_size = getattr(args, "eval_batch_size", 16) or 16
 
     path_list = [
         "appendicitis",
@@ -63,8 +110,10 @@ def evaluate(args):
 
     all_evals = {}
     all_results = {}
+    # Batches of patients to score as (pathology, [(_id, result, reference)])
+    batches = []
     for pathology in path_list:
-        print(f"Evaluating {pathology}...")
+        print(f"Loading {pathology}...")
         if pathology in [
             "appendicitis",
             "cholecystitis",
@@ -87,36 +136,47 @@ def evaluate(args):
         # Load LLM Prediction
         result_path = os.path.join(result_dir, f"{pathology}.pkl")
 
-        results = []
-        for r in read_from_pickle_file(glob.glob(result_path)[0]):
-            results.append(r)
-        results = {k: v for d in results for k, v in d.items()}
+        results = ResultsStore(glob.glob(result_path)[0])
 
+        patients = []
         for _id in id_difficulty[pathology][difficulty]:
             if _id not in results:
                 print(f"Skipping {_id} | {glob.glob(result_path)[0]}")
                 continue
 
-            result = "Final Diagnosis: " + results[_id]
-
-            evaluator = load_evaluator(pathology)
-
-            eval = evaluator._evaluate_agent_trajectory(
-                prediction=result,
-                input="",
-                reference=(
-                    hadm_info_clean[_id]["Discharge Diagnosis"],
-                    hadm_info_clean[_id]["ICD Diagnosis"],
-                    hadm_info_clean[_id]["Procedures ICD9"],
-                    hadm_info_clean[_id]["Procedures ICD10"],
-                    hadm_info_clean[_id]["Procedures Discharge"],
-                ),
-                agent_trajectory=[],
-                diagnosis_probabilities=None,
+            result = "Final Diagnosis: " + results.get(_id)
+            reference = (
+                hadm_info_clean[_id]["Discharge Diagnosis"],
+                hadm_info_clean[_id]["ICD Diagnosis"],
+                hadm_info_clean[_id]["Procedures ICD9"],
+                hadm_info_clean[_id]["Procedures ICD10"],
+                hadm_info_clean[_id]["Procedures Discharge"],
             )
+            patients.append((_id, result, reference))
+            all_results[pathology][_id] = result
+
+        for i in range(0, len(patients), eval_batch_size):
+            batches.append((pathology, patients[i : i + eval_batch_size]))
+
+    print(f"Evaluating {len(batches)} batches with {num_workers} workers...")
+    if num_workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=num_workers, initializer=init_evaluation_worker
+        ) as executor:
+            futures = [
+                executor.submit(evaluate_patients, pathology, patients)
+                for pathology, patients in batches
+            ]
+            # Collect in submission order so that evaluation.pkl does not depend on which worker finishes first
+            outputs = [future.result() for future in futures]
+    else:
+        outputs = [
+            evaluate_patients(pathology, patients) for pathology, patients in batches
+        ]
 
+    for (pathology, _), (evals, _) in zip(batches, outputs):
+        for _id, eval in evals:
             all_evals[pathology][_id] = eval
-            all_results[pathology][_id] = result
 
     avg_scores = {}
     avg_samples = {}
@@ -132,6 +192,9 @@ def evaluate(args):
 
     evaluation_result = {"all": all_evals, "average": avg_scores}
     print(evaluation_result["average"]["Diagnosis"])
+    print(
+        f"Parsed sentence cache: {merge_cache_stats([stats for _, stats in outputs])}"
+    )
     pickle.dump(
         evaluation_result,
         open(os.path.join(result_dir, "evaluation.pkl"), "wb"),
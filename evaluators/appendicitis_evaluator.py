@@ -16,48 +16,37 @@ from icd.procedure_mappings import (
 class AppendicitisEvaluator(PathologyEvaluator):
     """Evaluate the trajectory according to clinical diagnosis guidelines of appendicitis."""
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.pathology = "appendicitis"
-        self.alternative_pathology_names = [
-            {
-                "location": "appendi",
-                "modifiers": [
-                    "gangren",
-                    "infect",
-                    "inflam",
-                    "abscess",
-                    "rupture",
-                    "necros",
-                    "perf",
-                ],
-            }
-        ]
-        self.gracious_alternative_pathology_names = []
-
-        self.required_lab_tests = {
-            "Inflammation": INFLAMMATION_LAB_TESTS,
+    pathology = "appendicitis"
+    alternative_pathology_names = [
+        {
+            "location": "appendi",
+            "modifiers": [
+                "gangren",
+                "infect",
+                "inflam",
+                "abscess",
+                "rupture",
+                "necros",
+                "perf",
+            ],
         }
-        for req_lab_test_name in self.required_lab_tests:
-            self.answers["Correct Laboratory Tests"][req_lab_test_name] = []
+    ]
+    gracious_alternative_pathology_names = []
+
+    required_lab_tests = {
+        "Inflammation": INFLAMMATION_LAB_TESTS,
+    }
 
-        self.neutral_lab_tests = []
-        self.neutral_lab_tests.extend(
-            ADDITIONAL_LAB_TEST_MAPPING["Complete Blood Count (CBC)"]
-        )
-        self.neutral_lab_tests.extend(
-            ADDITIONAL_LAB_TEST_MAPPING["Liver Function Panel (LFP)"]
-        )
-        self.neutral_lab_tests.extend(
-            ADDITIONAL_LAB_TEST_MAPPING["Renal Function Panel (RFP)"]
-        )
-        self.neutral_lab_tests.extend(ADDITIONAL_LAB_TEST_MAPPING["Urinalysis"])
-        self.neutral_lab_tests = [
-            t
-            for t in self.neutral_lab_tests
-            if t not in self.required_lab_tests["Inflammation"]
-        ]
+    # Tests that are also required are removed in PathologyEvaluator.__init_subclass__
+    neutral_lab_tests = (
+        ADDITIONAL_LAB_TEST_MAPPING["Complete Blood Count (CBC)"]
+        + ADDITIONAL_LAB_TEST_MAPPING["Liver Function Panel (LFP)"]
+        + ADDITIONAL_LAB_TEST_MAPPING["Renal Function Panel (RFP)"]
+        + ADDITIONAL_LAB_TEST_MAPPING["Urinalysis"]
+    )
 
+    def reset(self):
+        super().reset()
         self.answers["Treatment Requested"] = {
             "Appendectomy": False,
             "Antibiotics": False,
@@ -16,68 +16,55 @@ from icd.procedure_mappings import (
 class CholecystitisEvaluator(PathologyEvaluator):
     """Evaluate the trajectory according to clinical diagnosis guidelines of cholecystitis."""
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.pathology = "cholecystitis"
-        self.alternative_pathology_names = [
-            {
-                "location": "gallbladder",
-                "modifiers": [
-                    "gangren",
-                    "infect",
-                    "inflam",
-                    "abscess",
-                    "necros",
-                    "perf",
-                ],
-            },
-            {
-                "location": "cholangitis",
-                "modifiers": [
-                    "cholangitis",
-                ],
-            },
-        ]
-        self.gracious_alternative_pathology_names = [
-            {"location": "acute gallbladder", "modifiers": ["disease", "attack"]},
-            {"location": "acute biliary", "modifiers": ["colic"]},
-        ]
-
-        self.required_lab_tests = {
-            "Inflammation": INFLAMMATION_LAB_TESTS,
-            "Liver": [
-                50861,  # "Alanine Aminotransferase (ALT)",
-                50878,  # "Asparate Aminotransferase (AST)",
+    pathology = "cholecystitis"
+    alternative_pathology_names = [
+        {
+            "location": "gallbladder",
+            "modifiers": [
+                "gangren",
+                "infect",
+                "inflam",
+                "abscess",
+                "necros",
+                "perf",
             ],
-            "Gallbladder": [
-                50883,  # "Bilirubin",
-                50927,  # "Gamma Glutamyltransferase",
+        },
+        {
+            "location": "cholangitis",
+            "modifiers": [
+                "cholangitis",
             ],
-        }
-        for req_lab_test_name in self.required_lab_tests:
-            self.answers["Correct Laboratory Tests"][req_lab_test_name] = []
+        },
+    ]
+    gracious_alternative_pathology_names = [
+        {"location": "acute gallbladder", "modifiers": ["disease", "attack"]},
+        {"location": "acute biliary", "modifiers": ["colic"]},
+    ]
+
+    required_lab_tests = {
+        "Inflammation": INFLAMMATION_LAB_TESTS,
+        "Liver": [
+            50861,  # "Alanine Aminotransferase (ALT)",
+            50878,  # "Asparate Aminotransferase (AST)",
+        ],
+        "Gallbladder": [
+            50883,  # "Bilirubin",
+            50927,  # "Gamma Glutamyltransferase",
+        ],
+    }
 
-        self.neutral_lab_tests = []
-        self.neutral_lab_tests.extend(
-            ADDITIONAL_LAB_TEST_MAPPING["Complete Blood Count (CBC)"]
-        )
-        self.neutral_lab_tests.extend(
-            ADDITIONAL_LAB_TEST_MAPPING["Renal Function Panel (RFP)"]
-        )
-        self.neutral_lab_tests.extend(
-            [
-                50863,  # "Alkaline Phosphatase"
-            ]
-        )
-        self.neutral_lab_tests.extend(ADDITIONAL_LAB_TEST_MAPPING["Urinalysis"])
-        self.neutral_lab_tests = [
-            t
-            for t in self.neutral_lab_tests
-            if t not in self.required_lab_tests["Inflammation"]
-            and t not in self.required_lab_tests["Liver"]
-            and t not in self.required_lab_tests["Gallbladder"]
+    # Tests that are also required are removed in PathologyEvaluator.__init_subclass__
+    neutral_lab_tests = (
+        ADDITIONAL_LAB_TEST_MAPPING["Complete Blood Count (CBC)"]
+        + ADDITIONAL_LAB_TEST_MAPPING["Renal Function Panel (RFP)"]
+        + [
+            50863,  # "Alkaline Phosphatase"
         ]
+        + ADDITIONAL_LAB_TEST_MAPPING["Urinalysis"]
+    )
 
+    def reset(self):
+        super().reset()
         self.answers["Treatment Requested"] = {
             "Cholecystectomy": False,
             "Antibiotics": False,
@@ -25,51 +25,40 @@ class DiverticulitisEvaluator(PathologyEvaluator):
 
     # nlp = spacy.load("en_core_web_sm")
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.pathology = "diverticulitis"
-        self.alternative_pathology_names = [
-            {
-                "location": "diverticul",
-                "modifiers": ["inflam", "infect", "abscess", "perf", "rupture"],
-            },
-        ]
-        self.gracious_alternative_pathology_names = [
-            {
-                "location": "acute colonic",
-                "modifiers": ["perfor"],
-            },
-            {
-                "location": "sigmoid",
-                "modifiers": ["perfor"],
-            },
-            {
-                "location": "sigmoid",
-                "modifiers": ["colitis"],
-            },
-        ]
-
-        self.required_lab_tests = {"Inflammation": INFLAMMATION_LAB_TESTS}
-        for req_lab_test_name in self.required_lab_tests:
-            self.answers["Correct Laboratory Tests"][req_lab_test_name] = []
-
-        self.neutral_lab_tests = []
-        self.neutral_lab_tests.extend(
-            ADDITIONAL_LAB_TEST_MAPPING["Complete Blood Count (CBC)"]
-        )
-        self.neutral_lab_tests.extend(
-            ADDITIONAL_LAB_TEST_MAPPING["Liver Function Panel (LFP)"]
-        )
-        self.neutral_lab_tests.extend(
-            ADDITIONAL_LAB_TEST_MAPPING["Renal Function Panel (RFP)"]
-        )
-        self.neutral_lab_tests.extend(ADDITIONAL_LAB_TEST_MAPPING["Urinalysis"])
-        self.neutral_lab_tests = [
-            t
-            for t in self.neutral_lab_tests
-            if t not in self.required_lab_tests["Inflammation"]
-        ]
-
+    pathology = "diverticulitis"
+    alternative_pathology_names = [
+        {
+            "location": "diverticul",
+            "modifiers": ["inflam", "infect", "abscess", "perf", "rupture"],
+        },
+    ]
+    gracious_alternative_pathology_names = [
+        {
+            "location": "acute colonic",
+            "modifiers": ["perfor"],
+        },
+        {
+            "location": "sigmoid",
+            "modifiers": ["perfor"],
+        },
+        {
+            "location": "sigmoid",
+            "modifiers": ["colitis"],
+        },
+    ]
+
+    required_lab_tests = {"Inflammation": INFLAMMATION_LAB_TESTS}
+
+    # Tests that are also required are removed in PathologyEvaluator.__init_subclass__
+    neutral_lab_tests = (
+        ADDITIONAL_LAB_TEST_MAPPING["Complete Blood Count (CBC)"]
+        + ADDITIONAL_LAB_TEST_MAPPING["Liver Function Panel (LFP)"]
+        + ADDITIONAL_LAB_TEST_MAPPING["Renal Function Panel (RFP)"]
+        + ADDITIONAL_LAB_TEST_MAPPING["Urinalysis"]
+    )
+
+    def reset(self):
+        super().reset()
         self.answers["Treatment Requested"] = {
             "Colonoscopy": False,
             "Antibiotics": False,
@@ -24,68 +24,55 @@ from icd.procedure_mappings import (
 class PancreatitisEvaluator(PathologyEvaluator):
     """Evaluate the trajectory according to clinical diagnosis guidelines of pancreatitis."""
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.pathology = "pancreatitis"
-        self.alternative_pathology_names = [
-            {
-                "location": "pancrea",
-                "modifiers": [
-                    "gangren",
-                    "infect",
-                    "inflam",
-                    "abscess",
-                    "necros",
-                ],
-            }
-        ]
-        self.gracious_alternative_pathology_names = []
-
-        self.required_lab_tests = {
-            "Inflammation": INFLAMMATION_LAB_TESTS,
-            "Pancreas": [
-                50867,  # Amylase
-                50956,  # Lipase
-            ],
-            "Seriousness": [
-                51480,  # "Hematocrit",
-                50810,
-                51221,
-                51638,
-                51006,  # "Urea Nitrogen",
-                52647,
-                51000,  # "Triglycerides",
-                50893,  # "Calcium, Total",
-                50824,  # "Sodium",
-                52623,
-                50983,
-                52610,  # "Potassium",
-                50971,
-                50822,
+    pathology = "pancreatitis"
+    alternative_pathology_names = [
+        {
+            "location": "pancrea",
+            "modifiers": [
+                "gangren",
+                "infect",
+                "inflam",
+                "abscess",
+                "necros",
             ],
         }
-        for req_lab_test_name in self.required_lab_tests:
-            self.answers["Correct Laboratory Tests"][req_lab_test_name] = []
+    ]
+    gracious_alternative_pathology_names = []
+
+    required_lab_tests = {
+        "Inflammation": INFLAMMATION_LAB_TESTS,
+        "Pancreas": [
+            50867,  # Amylase
+            50956,  # Lipase
+        ],
+        "Seriousness": [
+            51480,  # "Hematocrit",
+            50810,
+            51221,
+            51638,
+            51006,  # "Urea Nitrogen",
+            52647,
+            51000,  # "Triglycerides",
+            50893,  # "Calcium, Total",
+            50824,  # "Sodium",
+            52623,
+            50983,
+            52610,  # "Potassium",
+            50971,
+            50822,
+        ],
+    }
 
-        self.neutral_lab_tests = []
-        self.neutral_lab_tests.extend(
-            ADDITIONAL_LAB_TEST_MAPPING["Complete Blood Count (CBC)"]
-        )
-        self.neutral_lab_tests.extend(
-            ADDITIONAL_LAB_TEST_MAPPING["Liver Function Panel (LFP)"]
-        )
-        self.neutral_lab_tests.extend(
-            ADDITIONAL_LAB_TEST_MAPPING["Renal Function Panel (RFP)"]
-        )
-        self.neutral_lab_tests.extend(ADDITIONAL_LAB_TEST_MAPPING["Urinalysis"])
-        self.neutral_lab_tests = [
-            t
-            for t in self.neutral_lab_tests
-            if t not in self.required_lab_tests["Inflammation"]
-            and t not in self.required_lab_tests["Pancreas"]
-            and t not in self.required_lab_tests["Seriousness"]
-        ]
+    # Tests that are also required are removed in PathologyEvaluator.__init_subclass__
+    neutral_lab_tests = (
+        ADDITIONAL_LAB_TEST_MAPPING["Complete Blood Count (CBC)"]
+        + ADDITIONAL_LAB_TEST_MAPPING["Liver Function Panel (LFP)"]
+        + ADDITIONAL_LAB_TEST_MAPPING["Renal Function Panel (RFP)"]
+        + ADDITIONAL_LAB_TEST_MAPPING["Urinalysis"]
+    )
 
+    def reset(self):
+        super().reset()
         self.answers["Treatment Requested"] = {
             "Support": False,
             "Drainage": False,
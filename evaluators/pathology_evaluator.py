@@ -21,14 +21,37 @@ class PathologyEvaluator(AgentTrajectoryEvaluator):
     required_lab_tests: Dict[str, List[str]]
     neutral_lab_tests: List[str]
 
+    # Membership sets of the lab tests, computed once per class
+    required_lab_test_sets: Dict[str, frozenset]
+    neutral_lab_test_set: frozenset
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if not hasattr(cls, "required_lab_tests"):
+            return
+        cls.required_lab_test_sets = {
+            test_category: frozenset(valid_test_names)
+            for test_category, valid_test_names in cls.required_lab_tests.items()
+        }
+        required = frozenset().union(*cls.required_lab_test_sets.values())
+        # Neutral tests never include required tests
+        cls.neutral_lab_tests = [t for t in cls.neutral_lab_tests if t not in required]
+        cls.neutral_lab_test_set = frozenset(cls.neutral_lab_tests)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.reset()
+
+    def reset(self):
+        """Clears the answers and scores so that the evaluator can be reused for the next patient. New dicts are created because the evaluation of the previous patient returned the old ones."""
         self.answers = {
             "Diagnosis": "",
             "Diagnostic Confidence": None,
             "Treatment": "",
             "Unnecessary Laboratory Tests": [],
-            "Correct Laboratory Tests": {},
+            "Correct Laboratory Tests": {
+                test_category: [] for test_category in self.required_lab_tests
+            },
             "Unnecessary Imaging": [],
             "Correct Imaging": [],
         }
@@ -294,7 +317,7 @@ class PathologyEvaluator(AgentTrajectoryEvaluator):
           action (AgentAction): The laboratory test action.
         """
         for test in action.tool_input["action_input"]:
-            for test_category, valid_test_names in self.required_lab_tests.items():
+            for test_category, valid_test_names in self.required_lab_test_sets.items():
                 if test in valid_test_names:
                     # Only provide points for first test occurance in each category
                     if (
@@ -305,7 +328,7 @@ class PathologyEvaluator(AgentTrajectoryEvaluator):
                     self.answers["Correct Laboratory Tests"][test_category].append(test)
                     break
             else:
-                if test not in self.neutral_lab_tests:
+                if test not in self.neutral_lab_test_set:
                     self.answers["Unnecessary Laboratory Tests"].append(test)
 
     def score_imaging_action(
@@ -13,61 +13,56 @@ from icd.procedure_mappings import (
 )
 
 class PericarditisEvaluator(PathologyEvaluator):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.pathology = "pericarditis"
-        self.alternative_pathology_names = [
-            {
-            "location": "pericard",
-            "modifiers": ["inflammation", "inflammatory disease"]
-            },
-            {
-            "location": "pericardial",
-            "modifiers": ["inflammation", "inflammatory change", "pericardial inflammation"]
-            },
-            {
-            "location": "heart sac",
-            "modifiers": ["inflammation"]
-            },
-            {
-            "location": "cardiac membrane",
-            "modifiers": ["inflammation"]
-            }
-        ]
-        self.gracious_alternative_pathology_names = [
-            {
-            "location": "pericard",
-            "modifiers": ["effusion", "fluid accumulation", "thickening", "fibrosis", "adhesion", "calcification"]
-            },
-            {
-            "location": "pericardial",
-            "modifiers": ["effusion", "thickening", "fluid", "fibrosis", "adhesions"]
-            }
-        ]
-
-        # 实验室检查配置
-        self.required_lab_tests = {
-            "Inflammation": INFLAMMATION_LAB_TESTS + [
-                50889,  # CRP
-                51288   # ESR
-            ],
-            "Cardiac Damage": [
-                51003,  # Troponin T
-                50963,  # BNP
-            ],
+    pathology = "pericarditis"
+    alternative_pathology_names = [
+        {
+        "location": "pericard",
+        "modifiers": ["inflammation", "inflammatory disease"]
+        },
+        {
+        "location": "pericardial",
+        "modifiers": ["inflammation", "inflammatory change", "pericardial inflammation"]
+        },
+        {
+        "location": "heart sac",
+        "modifiers": ["inflammation"]
+        },
+        {
+        "location": "cardiac membrane",
+        "modifiers": ["inflammation"]
+        }
+    ]
+    gracious_alternative_pathology_names = [
+        {
+        "location": "pericard",
+        "modifiers": ["effusion", "fluid accumulation", "thickening", "fibrosis", "adhesion", "calcification"]
+        },
+        {
+        "location": "pericardial",
+        "modifiers": ["effusion", "thickening", "fluid", "fibrosis", "adhesions"]
         }
-        for req_lab_test_name in self.required_lab_tests:
-            self.answers["Correct Laboratory Tests"][req_lab_test_name] = []
+    ]
+
+    # 实验室检查配置
+    required_lab_tests = {
+        "Inflammation": INFLAMMATION_LAB_TESTS + [
+            50889,  # CRP
+            51288   # ESR
+        ],
+        "Cardiac Damage": [
+            51003,  # Troponin T
+            50963,  # BNP
+        ],
+    }
 
-        self.neutral_lab_tests = []
-        self.neutral_lab_tests.extend(ADDITIONAL_LAB_TEST_MAPPING["Complete Blood Count (CBC)"])
-        self.neutral_lab_tests.extend(ADDITIONAL_LAB_TEST_MAPPING["Renal Function Panel (RFP)"])
-        self.neutral_lab_tests = [
-            t for t in self.neutral_lab_tests
-            if t not in self.required_lab_tests["Inflammation"]
-            and t not in self.required_lab_tests["Cardiac Damage"]
-        ]
+    # Tests that are also required are removed in PathologyEvaluator.__init_subclass__
+    neutral_lab_tests = (
+        ADDITIONAL_LAB_TEST_MAPPING["Complete Blood Count (CBC)"]
+        + ADDITIONAL_LAB_TEST_MAPPING["Renal Function Panel (RFP)"]
+    )
 
+    def reset(self):
+        super().reset()
         # 治疗评估配置
         self.answers["Treatment Requested"] = {
             "AntiInflammatory": False,
@@ -16,62 +16,50 @@ from icd.procedure_mappings import (
 )
 
 class PneumoniaEvaluator(PathologyEvaluator):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.pathology = "pneumonia"
-        self.alternative_pathology_names = [
-            {
-                "location": "lung",
-                "modifiers": ["infect", "pneumonitis", "bacterial", "viral", "aspiration"],
-            },
-            {
-                "location": "pneumonia",
-                "modifiers": ["acute", "pneumonitis", "bacterial", "viral", "aspiration"],
-            },
-        ]
-        self.gracious_alternative_pathology_names = [
-            {
-                "location": "respiratory",
-                "modifiers": ["infection", "bacterial", "viral", "fungal"],
-            },
-        ]
+    pathology = "pneumonia"
+    alternative_pathology_names = [
+        {
+            "location": "lung",
+            "modifiers": ["infect", "pneumonitis", "bacterial", "viral", "aspiration"],
+        },
+        {
+            "location": "pneumonia",
+            "modifiers": ["acute", "pneumonitis", "bacterial", "viral", "aspiration"],
+        },
+    ]
+    gracious_alternative_pathology_names = [
+        {
+            "location": "respiratory",
+            "modifiers": ["infection", "bacterial", "viral", "fungal"],
+        },
+    ]
 
-        # Define required and neutral lab tests
-        self.required_lab_tests = {"Inflammation": INFLAMMATION_LAB_TESTS+[50890],
-                                   "Microbiology": [
-                                        90234,  # 痰培养
-                                        90201,  # 血培养
-                                        50890,  # 降钙素原
-                                    ],
-                                    "Gas Analysis": [
-                                        50818,  # 血气分析中的pH
-                                        50820,  # PaCO2
-                                        50821,  # PaO2
-                                        50822,  # 血钾（重症肺炎相关）
-                                    ],
-            }
-        for req_lab_test_name in self.required_lab_tests:
-            self.answers["Correct Laboratory Tests"][req_lab_test_name] = []
+    # Define required and neutral lab tests
+    required_lab_tests = {
+        "Inflammation": INFLAMMATION_LAB_TESTS + [50890],
+        "Microbiology": [
+            90234,  # 痰培养
+            90201,  # 血培养
+            50890,  # 降钙素原
+        ],
+        "Gas Analysis": [
+            50818,  # 血气分析中的pH
+            50820,  # PaCO2
+            50821,  # PaO2
+            50822,  # 血钾（重症肺炎相关）
+        ],
+    }
 
-        self.neutral_lab_tests = []
-        self.neutral_lab_tests.extend(
-            ADDITIONAL_LAB_TEST_MAPPING["Complete Blood Count (CBC)"]
-        )
-        self.neutral_lab_tests.extend(
-            ADDITIONAL_LAB_TEST_MAPPING["Liver Function Panel (LFP)"]
-        )
-        self.neutral_lab_tests.extend(
-            ADDITIONAL_LAB_TEST_MAPPING["Renal Function Panel (RFP)"]
-        )
-        self.neutral_lab_tests.extend(ADDITIONAL_LAB_TEST_MAPPING["Urinalysis"])
-        self.neutral_lab_tests = [
-            t
-            for t in self.neutral_lab_tests
-            if t not in self.required_lab_tests["Inflammation"]
-            and t not in self.required_lab_tests["Microbiology"]
-            and t not in self.required_lab_tests["Gas Analysis"]
-        ]
+    # Tests that are also required are removed in PathologyEvaluator.__init_subclass__
+    neutral_lab_tests = (
+        ADDITIONAL_LAB_TEST_MAPPING["Complete Blood Count (CBC)"]
+        + ADDITIONAL_LAB_TEST_MAPPING["Liver Function Panel (LFP)"]
+        + ADDITIONAL_LAB_TEST_MAPPING["Renal Function Panel (RFP)"]
+        + ADDITIONAL_LAB_TEST_MAPPING["Urinalysis"]
+    )
 
+    def reset(self):
+        super().reset()
         self.answers["Treatment Requested"] = {
             "Antibiotics": False,
             "Ventilation": False,
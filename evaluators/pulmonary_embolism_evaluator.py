@@ -13,55 +13,45 @@ from icd.procedure_mappings import (
 class PulmonaryEmbolismEvaluator(PathologyEvaluator):
     """Evaluate the trajectory according to clinical diagnosis guidelines of pulmonary embolism."""
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-                # 增加病理名称的模糊匹配模式
-        self._diagnosis_patterns = [
-            re.compile(r'\b(?:pulmonary\s+embolism|PE)\b', re.IGNORECASE),  # 主模式
-            re.compile(r'\b(?:pulmonary|PE)\b.*?\b(?:embolus|thrombus)\b', re.IGNORECASE)  # 替代模式
-        ]
-        self.pathology = "pulmonary embolism"
-        self.alternative_pathology_names = [
-            {
-                "location": "pulmonary",
-                "modifiers": ["embolism", "embolus", "thrombus"],
-            },
-            {
-                "location": "PE",
-                "modifiers": []
-            },
-        ]
-        self.gracious_alternative_pathology_names = []
+    # 增加病理名称的模糊匹配模式
+    _diagnosis_patterns = [
+        re.compile(r'\b(?:pulmonary\s+embolism|PE)\b', re.IGNORECASE),  # 主模式
+        re.compile(r'\b(?:pulmonary|PE)\b.*?\b(?:embolus|thrombus)\b', re.IGNORECASE)  # 替代模式
+    ]
+    pathology = "pulmonary embolism"
+    alternative_pathology_names = [
+        {
+            "location": "pulmonary",
+            "modifiers": ["embolism", "embolus", "thrombus"],
+        },
+        {
+            "location": "PE",
+            "modifiers": []
+        },
+    ]
+    gracious_alternative_pathology_names = []
 
-        # Define required laboratory tests
-        self.required_lab_tests = {
-            "Inflammation": INFLAMMATION_LAB_TESTS,
-            "Coagulation": [
-                50915,  # D-dimer
-                50885,  # Fibrinogen
-                51274,  # PT
-                51275,  # PTT
-                51675,  # "INR(PT)",
-                51237,  # "INR(PT)",
-            ],
-        }
-        for req_lab_test_name in self.required_lab_tests:
-            self.answers["Correct Laboratory Tests"][req_lab_test_name] = []
+    # Define required laboratory tests
+    required_lab_tests = {
+        "Inflammation": INFLAMMATION_LAB_TESTS,
+        "Coagulation": [
+            50915,  # D-dimer
+            50885,  # Fibrinogen
+            51274,  # PT
+            51275,  # PTT
+            51675,  # "INR(PT)",
+            51237,  # "INR(PT)",
+        ],
+    }
 
-        # Define neutral lab tests
-        self.neutral_lab_tests = []
-        self.neutral_lab_tests.extend(
-            ADDITIONAL_LAB_TEST_MAPPING["Complete Blood Count (CBC)"]
-        )
-        self.neutral_lab_tests.extend(
-            ADDITIONAL_LAB_TEST_MAPPING["Renal Function Panel (RFP)"]
-        )
-        self.neutral_lab_tests = [
-            t for t in self.neutral_lab_tests
-            if t not in self.required_lab_tests["Coagulation"]
-            and t not in self.required_lab_tests["Inflammation"]
-        ]
+    # Tests that are also required are removed in PathologyEvaluator.__init_subclass__
+    neutral_lab_tests = (
+        ADDITIONAL_LAB_TEST_MAPPING["Complete Blood Count (CBC)"]
+        + ADDITIONAL_LAB_TEST_MAPPING["Renal Function Panel (RFP)"]
+    )
 
+    def reset(self):
+        super().reset()
         # Initialize treatment tracking
         self.answers["Treatment Requested"] = {
             "Anticoagulation": False,
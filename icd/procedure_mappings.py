@@ -1,3 +1,7 @@
+import os
+import pickle
+
+
 # Parses the procedure names of either ICD9 or ICD10 into a dictionary with code as key and name as value
 def parse_icd_names_file(icd_names_path):
     with open(icd_names_path, "r") as f:
@@ -24,6 +28,117 @@ def parse_icd_mapping_file(icd_mapping_path):
     return icd_mapping
 
 
+# Reads a parsed names or mapping file from its binary cache next to the file or parses it and writes the cache. The cache is rebuilt whenever the size or modification time of the file changes
+def load_cached_icd_file(path, parse):
+    cache_path = path + ".pkl"
+    signature = (os.path.getmtime(path), os.path.getsize(path))
+
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            try:
+                cached_signature, table = pickle.load(f)
+                if cached_signature == signature:
+                    return table
+            except (pickle.UnpicklingError, EOFError, ValueError):
+                pass
+
+    table = parse(path)
+    try:
+        # Write to a temporary file first so that an interrupted write never leaves a broken cache behind
+        with open(cache_path + ".tmp", "wb") as f:
+            pickle.dump((signature, table), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_path + ".tmp", cache_path)
+    except OSError:
+        print(f"Could not write cache of {path}")
+    return table
+
+
+_icd_tables = {}
+
+
+# Every names or mapping file is only loaded once per process
+def get_icd_table(path, parse):
+    if path not in _icd_tables:
+        _icd_tables[path] = load_cached_icd_file(path, parse)
+    return _icd_tables[path]
+
+
+# Converts between ICD9 and ICD10 procedure codes using the GEM mapping of each direction. Files are only loaded when first needed
+class ICDMappingService:
+    def __init__(
+        self,
+        procedure_names_icd9_path,
+        procedure_names_icd10_path,
+        icd9_to_10_mapping_path,
+        icd10_to_9_mapping_path,
+    ):
+        self.procedure_names_paths = {
+            9: procedure_names_icd9_path,
+            10: procedure_names_icd10_path,
+        }
+        # Mapping file used to convert from the key version to the other version
+        self.mapping_paths = {9: icd9_to_10_mapping_path, 10: icd10_to_9_mapping_path}
+
+    def names(self, icd_version):
+        return get_icd_table(
+            self.procedure_names_paths[icd_version], parse_icd_names_file
+        )
+
+    def mapping(self, input_icd_version):
+        return get_icd_table(
+            self.mapping_paths[input_icd_version], parse_icd_mapping_file
+        )
+
+    def title(self, code, icd_version):
+        return self.names(icd_version)[code]
+
+    def convert(self, icd_codes, input_icd_version):
+        icd_mapping = self.mapping(input_icd_version)
+        output_icd_version = 10 if input_icd_version == 9 else 9
+        procedure_names = self.names(output_icd_version)
+
+        converted_codes = []
+        converted_codes_title = []
+        for c in icd_codes:
+            if c not in icd_mapping:
+                print("Could not find {} in mapping".format(c))
+                continue
+            for c2 in icd_mapping[c]:
+                if c2 not in procedure_names:
+                    print("Could not find {} in procedure names".format(c2))
+                    continue
+                converted_codes.append(c2)
+                converted_codes_title.append(procedure_names[c2])
+
+        return converted_codes, converted_codes_title
+
+    # Converts several lists of ICD codes with the same loaded mappings
+    def convert_many(self, icd_code_lists, input_icd_version):
+        return [
+            self.convert(icd_codes, input_icd_version) for icd_codes in icd_code_lists
+        ]
+
+
+_icd_mapping_services = {}
+
+
+def get_icd_mapping_service(
+    procedure_names_icd9_path,
+    procedure_names_icd10_path,
+    icd9_to_10_mapping_path,
+    icd10_to_9_mapping_path,
+):
+    paths = (
+        procedure_names_icd9_path,
+        procedure_names_icd10_path,
+        icd9_to_10_mapping_path,
+        icd10_to_9_mapping_path,
+    )
+    if paths not in _icd_mapping_services:
+        _icd_mapping_services[paths] = ICDMappingService(*paths)
+    return _icd_mapping_services[paths]
+
+
 # Converts a list of ICD codes from one version to another. Works for both ICD9 to ICD10 and ICD10 to ICD9. Also returns the title of the ICD codes
 def icd_converter(
     icd_codes,
@@ -33,30 +148,17 @@ def icd_converter(
     icd9_to_10_mapping_path,
     icd10_to_9_mapping_path,
 ):
-    if input_icd_version == 9:
-        icd_mapping = parse_icd_mapping_file(icd9_to_10_mapping_path)
-        procedure_names = parse_icd_names_file(procedure_names_icd10_path)
-    elif input_icd_version == 10:
-        icd_mapping = parse_icd_mapping_file(icd10_to_9_mapping_path)
-        procedure_names = parse_icd_names_file(procedure_names_icd9_path)
-    else:
+    if input_icd_version not in [9, 10]:
         print("Invalid input_icd_version. Only supports 9 and 10")
         return
 
-    converted_codes = []
-    converted_codes_title = []
-    for c in icd_codes:
-        if c not in icd_mapping:
-            print("Could not find {} in mapping".format(c))
-            continue
-        for c2 in icd_mapping[c]:
-            if c2 not in procedure_names:
-                print("Could not find {} in procedure names".format(c2))
-                continue
-            converted_codes.append(c2)
-            converted_codes_title.append(procedure_names[c2])
-
-    return converted_codes, converted_codes_title
+    service = get_icd_mapping_service(
+        procedure_names_icd9_path,
+        procedure_names_icd10_path,
+        icd9_to_10_mapping_path,
+        icd10_to_9_mapping_path,
+    )
+    return service.convert(icd_codes, input_icd_version)
 
 
 def uniqueify_lists(l1, l2):
@@ -75,16 +177,15 @@ def uniqueify_lists(l1, l2):
 def get_title_from_code(
     code, icd_version, procedure_names_icd9_path, procedure_names_icd10_path
 ):
-    if icd_version == 9:
-        procedure_names_icd9 = parse_icd_names_file(procedure_names_icd9_path)
-        return procedure_names_icd9[code]
-    elif icd_version == 10:
-        procedure_names_icd10 = parse_icd_names_file(procedure_names_icd10_path)
-        return procedure_names_icd10[code]
-    else:
+    if icd_version not in [9, 10]:
         print("Invalid icd_version. Only supports 9 and 10")
         return
 
+    procedure_names_path = (
+        procedure_names_icd9_path if icd_version == 9 else procedure_names_icd10_path
+    )
+    return get_icd_table(procedure_names_path, parse_icd_names_file)[code]
+
 
 ### ERCP ###
 
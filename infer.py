@@ -7,6 +7,8 @@ from datetime import datetime
 import time
 import pickle
 import fcntl
+import subprocess
+import sys
 
 import numpy as np
 import hydra
@@ -17,9 +19,19 @@ from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 from thefuzz import process
 
-from utils.nlp import calculate_num_tokens, truncate_text, create_lab_test_string
+from utils.nlp import (
+    calculate_num_tokens,
+    truncate_text,
+    create_lab_test_string,
+    TokenBudget,
+    token_cache_stats,
+)
 from dataset.utils import load_hadm_from_file
-from utils.logging import append_to_pickle_file
+from utils.logging import (
+    load_completed_ids,
+    merge_pickle_files,
+)
+from utils.results_store import ResultsStore
 from evaluators.appendicitis_evaluator import AppendicitisEvaluator
 from evaluators.cholecystitis_evaluator import CholecystitisEvaluator
 from evaluators.diverticulitis_evaluator import DiverticulitisEvaluator
@@ -43,7 +55,6 @@ from agents.prompts import (
     FULL_INFO_TEMPLATE_DIAGSUM_WITH_PAST,
 )
 from agents import guidelines_preofession
-from utils.logging import read_from_pickle_file
 
 
 gpt_tags = {
@@ -67,9 +78,7 @@ def load_all_past_diagnosis_results(pathology, result_dir):
         model_match = pattern.match(fname)
         model_name = model_match.group(1) if model_match else f"model{idx+1}"
         file_path = os.path.join(result_dir, fname)
-        data = {}
-        for d in read_from_pickle_file(file_path):
-            data.update(d)
+        data = ResultsStore(file_path).load_all()
         # 保证key为int
         data_int_keys = {int(k): v for k, v in data.items()}
         all_results[fname] = data_int_keys
@@ -144,6 +153,16 @@ def run(args: DictConfig):
     run_dir = args.local_logging_dir
     os.makedirs(run_dir, exist_ok=True)
 
+    # Sharded run. Without a shard_id we are the launcher that starts one worker per shard and merges their results
+    num_shards = getattr(args, "num_shards", 1)
+    shard_id = getattr(args, "shard_id", None)
+    if num_shards > 1 and shard_id is None:
+        launch_shards(args, run_name, run_dir, num_shards)
+        return
+    shard_name = run_name
+    if num_shards > 1:
+        shard_name += shard_suffix(shard_id, num_shards)
+
     random.seed(args.seed)
     np.random.seed(args.seed)
 
@@ -164,11 +183,17 @@ def run(args: DictConfig):
     llm = CustomLLM(
         model_name=args.model_name,
         openai_api_key=args.openai_api_key,
+        openai_api_base=getattr(args, "openai_api_base", None),
+        max_concurrency=getattr(args, "max_concurrency", 8),
         tags=tags,
         max_context_length=args.max_context_length,
         exllama=args.exllama,
         seed=args.seed,
         self_consistency=args.self_consistency,
+        prefix_cache=getattr(args, "prefix_cache", False),
+        save_probabilities=getattr(args, "save_probabilities", False),
+        max_batch_size=getattr(args, "batch_size", 1),
+        empty_cache=getattr(args, "empty_cache", False),
     )
     llm.load_model(args.base_models)
 
@@ -223,6 +248,8 @@ def run(args: DictConfig):
     langchain.debug = True
 
     diagnose_chain = LLMChain(llm=llm, prompt=prompt)
+    # Token counts of the template and static prompt sections are shared across patients
+    token_budget = TokenBudget(llm.tokenizer, basic_prompt, tags)
 
     if args.summarize:
         summarize_prompt = PromptTemplate(
@@ -254,8 +281,9 @@ def run(args: DictConfig):
     args.model_name = args.model_name.replace("/", "_")
 
     # Setup logfile and results path (match run_full_info.py naming)
-    results_path = join(run_dir, f"{run_name}_results.pkl")
-    log_path = join(run_dir, f"{run_name}.log")
+    results_path = join(run_dir, f"{shard_name}_results.pkl")
+    results_store = ResultsStore(results_path)
+    log_path = join(run_dir, f"{shard_name}.log")
     logger.add(log_path, enqueue=True, backtrace=True, diagnose=True)
     logger.info(args)
 
@@ -327,6 +355,32 @@ def run(args: DictConfig):
         with open(args.patient_list_path, "rb") as f:
             patient_list = pickle.load(f)
 
+    # Every shard takes every num_shards-th patient of the sorted list so the split is the same for every launch
+    if num_shards > 1:
+        patient_list = sorted(patient_list)[shard_id::num_shards]
+
+    # Only diagnose patients that are not yet in the results file of a previous (crashed) run
+    if getattr(args, "resume", False):
+        completed_ids = load_completed_ids(results_path)
+        # Patients of an earlier sharded run were already merged into the results file of the full run
+        if num_shards > 1:
+            completed_ids |= load_completed_ids(
+                join(run_dir, f"{run_name}_results.pkl"), repair=False
+            )
+        patient_list = [_id for _id in patient_list if _id not in completed_ids]
+        logger.info(
+            f"Resuming run. Skipping {len(completed_ids)} already diagnosed patients"
+        )
+
+    # Batched generation. COT needs a second call per patient on the result so is always done one by one
+    batch_size = getattr(args, "batch_size", 1)
+    if batch_size > 1 and args.prompt_template == "COT":
+        logger.warning("Batched generation not supported for COT. Using batch_size=1")
+        batch_size = 1
+    batch = []
+
+    evaluator = load_evaluator(args.pathology)
+
     for _id in patient_list:
         logger.info(f"Processing patient: {_id}")
         # continue
@@ -343,10 +397,8 @@ def run(args: DictConfig):
                     ai_tag_end=tags["ai_tag_end"],
                 )
 
-        # Eval
-        evaluator = load_evaluator(
-            args.pathology
-        )  # Reload every time to ensure no state is carried over
+        # Eval. Reset every time to ensure no state is carried over
+        evaluator.reset()
 
         input = ""
         rad_reports = ""
@@ -416,23 +468,27 @@ def run(args: DictConfig):
             diagnostic_guidelines,
             region,
             past_diagnosis_results=past_diagnosis_results_for_id,
+            token_budget=token_budget,
         )
 
+        predict_inputs = {
+            "input": input.format(rad_reports=rad_reports),
+            "fewshot_examples": fewshot_examples,
+            "diagnostic_guidelines": diagnostic_guidelines,
+            "stop": STOP_WORDS,
+        }
         if args.prompt_template == "DIAGSUM_WITH_PAST":
-            result = diagnose_chain.predict(
-                input=input.format(rad_reports=rad_reports),
-                fewshot_examples=fewshot_examples,
-                diagnostic_guidelines=diagnostic_guidelines,
-                past_diagnosis_results=past_diagnosis_results_for_id,
-                stop=STOP_WORDS,
-            )
-        else:
-            result = diagnose_chain.predict(
-                input=input.format(rad_reports=rad_reports),
-                fewshot_examples=fewshot_examples,
-                diagnostic_guidelines=diagnostic_guidelines,
-                stop=STOP_WORDS,
-            )
+            predict_inputs["past_diagnosis_results"] = past_diagnosis_results_for_id
+
+        # Collect patients and generate for all of them at once when the batch is full
+        if batch_size > 1:
+            batch.append((_id, predict_inputs))
+            if len(batch) >= batch_size:
+                diagnose_batch(diagnose_chain, batch, results_store)
+                batch = []
+            continue
+
+        result = diagnose_chain.predict(**predict_inputs)
 
         if args.prompt_template == "COT":
             # input = input.format(rad_reports=rad_reports)
@@ -459,7 +515,83 @@ def run(args: DictConfig):
                 stop=STOP_WORDS,
             )
 
-        append_to_pickle_file(results_path, {_id: result})
+        log_peak_memory(llm)
+        results_store.append({_id: result})
+
+    # Remaining patients of last incomplete batch
+    if batch:
+        diagnose_batch(diagnose_chain, batch, results_store)
+
+    logger.info(f"Token cache: {token_cache_stats()}")
+
+
+def shard_suffix(shard_id, num_shards):
+    return f"_shard{shard_id}of{num_shards}"
+
+
+def launch_shards(args, run_name, run_dir, num_shards):
+    # Distribute the shards over the given devices. If none are given use the devices visible to us
+    shard_devices = getattr(args, "shard_devices", None)
+    if not shard_devices and os.environ.get("CUDA_VISIBLE_DEVICES"):
+        shard_devices = os.environ["CUDA_VISIBLE_DEVICES"].split(",")
+
+    workers = []
+    for shard_id in range(num_shards):
+        env = os.environ.copy()
+        if shard_devices:
+            env["CUDA_VISIBLE_DEVICES"] = str(
+                shard_devices[shard_id % len(shard_devices)]
+            )
+        command = [
+            sys.executable,
+            os.path.abspath(sys.argv[0]),
+            *sys.argv[1:],
+            f"shard_id={shard_id}",
+        ]
+        logger.info(
+            f"Starting shard {shard_id} on device {env.get('CUDA_VISIBLE_DEVICES')}"
+        )
+        workers.append(subprocess.Popen(command, env=env))
+
+    failed_shards = [
+        shard_id for shard_id, worker in enumerate(workers) if worker.wait() != 0
+    ]
+
+    results_path = join(run_dir, f"{run_name}_results.pkl")
+    shard_paths = [
+        join(run_dir, f"{run_name}{shard_suffix(shard_id, num_shards)}_results.pkl")
+        for shard_id in range(num_shards)
+    ]
+    num_merged = merge_pickle_files(shard_paths, results_path)
+    logger.info(f"Merged {num_merged} patients into {results_path}")
+
+    # Keep the shard results of failed shards so that they can be resumed
+    if failed_shards:
+        logger.error(
+            f"Shards {failed_shards} failed. Rerun with resume=True to finish them"
+        )
+        return
+    for shard_path in shard_paths:
+        for path in [shard_path, shard_path + ".idx"]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def diagnose_batch(diagnose_chain, batch, results_store):
+    # Generates the diagnoses of multiple patients with a single call to the LLM and logs them one by one
+    outputs = diagnose_chain.apply([predict_inputs for _, predict_inputs in batch])
+    log_peak_memory(diagnose_chain.llm)
+    for (_id, _), output in zip(batch, outputs):
+        results_store.append({_id: output[diagnose_chain.output_key]})
+
+
+def log_peak_memory(llm):
+    # Peak GPU memory of the last call to the model, per device
+    if llm.peak_memory:
+        logger.info(
+            "Peak GPU memory: "
+            + ", ".join(f"{memory / 2**30:.2f} GiB" for memory in llm.peak_memory)
+        )
 
 
 def write_diagnostic_criteria(pathology, diag_crit_writer):
@@ -581,25 +713,27 @@ def control_context_length(
     diagnostic_guidelines,
     region,
     past_diagnosis_results=None,
+    token_budget=None,
 ):
     global STOP_WORDS
     max_context_length = args.max_context_length
     final_diagnosis_tokens = 25
-    total_length = calculate_num_tokens(
-        llm.tokenizer,
-        [
-            prompt_template.format(
-                input=input.format(rad_reports=rad_reports),
-                system_tag_start=tags["system_tag_start"],
-                system_tag_end=tags["system_tag_end"],
-                user_tag_start=tags["user_tag_start"],
-                user_tag_end=tags["user_tag_end"],
-                ai_tag_start=tags["ai_tag_start"],
-                fewshot_examples=fewshot_examples,
-                diagnostic_guidelines=diagnostic_guidelines,
-                past_diagnosis_results=past_diagnosis_results,
-            ),
-        ],
+
+    # Count every section of the prompt once and only recount the sections that change
+    if token_budget is None:
+        token_budget = TokenBudget(llm.tokenizer, prompt_template, tags)
+    token_budget.reset()
+    input_tokens = token_budget.count_section("input", input.format(rad_reports=""))
+    rad_tokens = token_budget.count(rad_reports)
+    fewshot_tokens = token_budget.count_section(
+        "fewshot_examples", fewshot_examples, static=True
+    )
+    fixed_tokens = token_budget.count_section(
+        "diagnostic_guidelines", diagnostic_guidelines, static=True
+    ) + token_budget.count_section("past_diagnosis_results", past_diagnosis_results)
+
+    total_length = token_budget.total(
+        input_tokens, rad_tokens, fewshot_tokens, fixed_tokens
     )
     # Check if our prompt would exceed the max context length and lead to truncation
     if total_length > max_context_length:
@@ -611,21 +745,11 @@ def control_context_length(
                 ai_tag_start=tags["ai_tag_start"],
                 ai_tag_end=tags["ai_tag_end"],
             )
-            total_length = calculate_num_tokens(
-                llm.tokenizer,
-                [
-                    prompt_template.format(
-                        input=input.format(rad_reports=rad_reports),
-                        system_tag_start=tags["system_tag_start"],
-                        system_tag_end=tags["system_tag_end"],
-                        user_tag_start=tags["user_tag_start"],
-                        user_tag_end=tags["user_tag_end"],
-                        ai_tag_start=tags["ai_tag_start"],
-                        fewshot_examples=fewshot_examples,
-                        diagnostic_guidelines=diagnostic_guidelines,
-                        past_diagnosis_results=past_diagnosis_results,
-                    ),
-                ],
+            fewshot_tokens = token_budget.count_section(
+                "fewshot_examples", fewshot_examples, static=True
+            )
+            total_length = token_budget.total(
+                input_tokens, rad_tokens, fewshot_tokens, fixed_tokens
             )
 
             # If we're still too long, completely remove examples
@@ -634,39 +758,14 @@ def control_context_length(
                 #    "Prompt is still too long. Removing all fewshot examples."
                 # )
                 fewshot_examples = ""
-                total_length = calculate_num_tokens(
-                    llm.tokenizer,
-                    [
-                        prompt_template.format(
-                            input=input.format(rad_reports=rad_reports),
-                            system_tag_start=tags["system_tag_start"],
-                            system_tag_end=tags["system_tag_end"],
-                            user_tag_start=tags["user_tag_start"],
-                            user_tag_end=tags["user_tag_end"],
-                            ai_tag_start=tags["ai_tag_start"],
-                            fewshot_examples=fewshot_examples,
-                            diagnostic_guidelines=diagnostic_guidelines,
-                            past_diagnosis_results=past_diagnosis_results,
-                        ),
-                    ],
+                fewshot_tokens = 0
+                total_length = token_budget.total(
+                    input_tokens, rad_tokens, fewshot_tokens, fixed_tokens
                 )
 
         # Before we start summarizing rad we should take a look if we are already over the context length
-        prompt_tokens_no_rad = calculate_num_tokens(
-            llm.tokenizer,
-            [
-                prompt_template.format(
-                    input=input.format(rad_reports=""),
-                    system_tag_start=tags["system_tag_start"],
-                    system_tag_end=tags["system_tag_end"],
-                    user_tag_start=tags["user_tag_start"],
-                    user_tag_end=tags["user_tag_end"],
-                    ai_tag_start=tags["ai_tag_start"],
-                    fewshot_examples=fewshot_examples,
-                    diagnostic_guidelines=diagnostic_guidelines,
-                    past_diagnosis_results=past_diagnosis_results,
-                )
-            ],
+        prompt_tokens_no_rad = token_budget.total(
+            input_tokens, fewshot_tokens, fixed_tokens
         )
         max_new_tokens = max_context_length - prompt_tokens_no_rad
         if max_new_tokens < final_diagnosis_tokens:
@@ -704,21 +803,9 @@ def control_context_length(
                         )
                         rad_reports += f"\n {summary}"
                         seen_modalities.add(rad["Modality"])
-                total_length = calculate_num_tokens(
-                    llm.tokenizer,
-                    [
-                        prompt_template.format(
-                            input=input.format(rad_reports=rad_reports),
-                            system_tag_start=tags["system_tag_start"],
-                            system_tag_end=tags["system_tag_end"],
-                            user_tag_start=tags["user_tag_start"],
-                            user_tag_end=tags["user_tag_end"],
-                            ai_tag_start=tags["ai_tag_start"],
-                            fewshot_examples=fewshot_examples,
-                            diagnostic_guidelines=diagnostic_guidelines,
-                            past_diagnosis_results=past_diagnosis_results,
-                        ),
-                    ],
+                rad_tokens = token_budget.count(rad_reports)
+                total_length = token_budget.total(
+                    input_tokens, rad_tokens, fewshot_tokens, fixed_tokens
                 )
 
             # If we are still too long, summarize the summary and enforce max characters
@@ -726,10 +813,7 @@ def control_context_length(
                 if summarize:
                     # Make sure that the length of rad_reports summary prompt is less than max_context_length
 
-                    length_rad_report = calculate_num_tokens(
-                        llm.tokenizer,
-                        [rad_reports],
-                    )
+                    length_rad_report = rad_tokens
                     if length_summarize_prompt + length_rad_report > max_context_length:
                         rad_reports = truncate_text(
                             llm.tokenizer,
@@ -750,6 +834,5 @@ def control_context_length(
 
     return input, fewshot_examples, rad_reports
 
-
 if __name__ == "__main__":
     run()
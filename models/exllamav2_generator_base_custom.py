@@ -8,6 +8,9 @@ from exllamav2.generator import ExLlamaV2Sampler
 import torch
 import random
 
+from models.utils import common_prefix_length
+from utils.nlp import encode_cached
+
 
 class ExLlamaV2BaseGenerator:
     # Internal state
@@ -17,6 +20,7 @@ class ExLlamaV2BaseGenerator:
     tokenizer: ExLlamaV2Tokenizer
 
     sequence_ids: torch.tensor = None
+    generated_lengths: list = None
 
     def __init__(self, model, cache, tokenizer):
         self.model = model
@@ -45,6 +49,9 @@ class ExLlamaV2BaseGenerator:
         decode_special_tokens=False,
         loras=None,
         stop_criteria=None,
+        reuse_prefix=False,
+        save_probabilities=True,
+        input_ids=None,
     ):
         # Accept LoRA or list of LoRAs
         if loras is not None and isinstance(loras, ExLlamaV2Lora):
@@ -58,7 +65,15 @@ class ExLlamaV2BaseGenerator:
         # Tokenize input and produce padding mask if needed
 
         batch_size = 1 if isinstance(prompt, str) else len(prompt)
-        ids = self.tokenizer.encode(prompt, encode_special_tokens=encode_special_tokens)
+        # Callers that already encoded the prompt pass its ids
+        if input_ids is not None:
+            ids = input_ids
+        elif isinstance(prompt, str) and encode_special_tokens:
+            ids = encode_cached(self.tokenizer, prompt)
+        else:
+            ids = self.tokenizer.encode(
+                prompt, encode_special_tokens=encode_special_tokens
+            )
 
         overflow = ids.shape[-1] + num_tokens - self.model.config.max_seq_len
         if overflow > 0:
@@ -77,7 +92,7 @@ class ExLlamaV2BaseGenerator:
 
         # Process prompt and begin gen
 
-        self._gen_begin_base(ids, mask, loras)
+        self._gen_begin_base(ids, mask, loras, reuse_prefix=reuse_prefix)
 
         # Begin filters
 
@@ -87,10 +102,24 @@ class ExLlamaV2BaseGenerator:
             else None
         )
 
-        # Generate tokens
+        # Generate tokens into buffers sized for the whole generation. sequence_ids is a view of the filled part so no token is copied again
+
+        prompt_length = self.sequence_ids.shape[-1]
+        token_buffer = torch.empty(
+            (batch_size, prompt_length + num_tokens), dtype=self.sequence_ids.dtype
+        )
+        token_buffer[:, :prompt_length] = self.sequence_ids
+        self.sequence_ids = token_buffer[:, :prompt_length]
+        probabilities_buffer = (
+            torch.empty((batch_size, num_tokens)) if save_probabilities else None
+        )
+
+        # Rows are finished once they generated a stop sequence or eos. Finished rows get the pad token instead of a sampled one until all rows are finished
+        finished = torch.zeros(batch_size, dtype=torch.bool)
+        generated_lengths = torch.zeros(batch_size, dtype=torch.long)
 
-        probabilities_sequence = torch.tensor([[]])
-        for _ in range(num_tokens):
+        num_generated = 0
+        for i in range(num_tokens):
             logits = (
                 self.model.forward(
                     self.sequence_ids[:, -1:], self.cache, input_mask=mask, loras=loras
@@ -106,21 +135,33 @@ class ExLlamaV2BaseGenerator:
                 self.tokenizer,
                 prefix_token=unhealed_token,
             )
-            self.sequence_ids = torch.cat([self.sequence_ids, token], dim=1)
-            probabilities_sequence = torch.cat(
-                [probabilities_sequence, probabilities], dim=1
-            )
+            if batch_size > 1:
+                token[finished] = self.tokenizer.pad_token_id
+                eos = token[:, 0] == self.tokenizer.eos_token_id
+            token_buffer[:, prompt_length + i : prompt_length + i + 1] = token
+            num_generated = i + 1
+            self.sequence_ids = token_buffer[:, : prompt_length + num_generated]
+            if probabilities_buffer is not None:
+                probabilities_buffer[:, i : i + 1] = probabilities
             gen_settings.feed_filters(token)
+            generated_lengths[~finished] += 1
 
             # Check for stop tokens
-            if stop_criteria(self.sequence_ids, None):
-                break
+            if stop_criteria is not None:
+                finished |= torch.as_tensor(
+                    stop_criteria(self.sequence_ids, None)
+                ).reshape(-1)
 
             unhealed_token = None
-            if eos:
+            finished |= torch.as_tensor(eos).reshape(-1)
+            if finished.all():
                 break
 
-        return self.sequence_ids, probabilities_sequence
+        # Number of tokens generated by every row up to and including its stop sequence or eos
+        self.generated_lengths = generated_lengths.tolist()
+        if probabilities_buffer is not None:
+            probabilities_buffer = probabilities_buffer[:, :num_generated]
+        return self.sequence_ids, probabilities_buffer
 
         # Decode
 
@@ -132,15 +173,31 @@ class ExLlamaV2BaseGenerator:
             return text[0]
         return text
 
-    def _gen_begin_base(self, input_ids, mask=None, loras=None):
-        self.cache.current_seq_len = 0
-        self.model.forward(
-            input_ids[:, :-1],
-            self.cache,
-            input_mask=mask,
-            preprocess_only=True,
-            loras=loras,
-        )
+    def _gen_begin_base(self, input_ids, mask=None, loras=None, reuse_prefix=False):
+        # The cache still holds the keys and values of the previous sequence. Keep those of the prefix it shares with the new prompt (i.e. system prompt, fewshot examples and guidelines) and only process the rest
+        reuse_length = 0
+        if (
+            reuse_prefix
+            and mask is None
+            and self.sequence_ids is not None
+            and self.sequence_ids.shape[0] == 1
+            and input_ids.shape[0] == 1
+        ):
+            reuse_length = min(
+                common_prefix_length(self.sequence_ids[0], input_ids[0]),
+                self.cache.current_seq_len,
+                input_ids.shape[-1] - 1,
+            )
+
+        self.cache.current_seq_len = reuse_length
+        if reuse_length < input_ids.shape[-1] - 1:
+            self.model.forward(
+                input_ids[:, reuse_length:-1],
+                self.cache,
+                input_mask=mask,
+                preprocess_only=True,
+                loras=loras,
+            )
 
         self.sequence_ids = input_ids.clone()
         self.sequence_ids = input_ids
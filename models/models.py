@@ -1,6 +1,8 @@
 import os
+import copy
+import asyncio
 from os.path import join
-from typing import Any, List, Mapping, Dict
+from typing import Any, List, Mapping, Dict, Optional
 
 import torch
 import openai
@@ -12,18 +14,31 @@ from tenacity import (
 from transformers import GenerationConfig, StoppingCriteriaList
 from auto_gptq import exllama_set_max_input_length
 from langchain.llms.base import LLM
+from langchain.schema import Generation, LLMResult
 from exllamav2.generator import ExLlamaV2Sampler
 import tiktoken
 
-from models.utils import create_stop_criteria, create_stop_criteria_exllama
+from models.utils import (
+    create_stop_criteria,
+    create_stop_criteria_exllama,
+    common_prefix_length,
+)
 from agents.agent import STOP_WORDS
-from utils.nlp import extract_sections
+from utils.nlp import extract_sections, encode_cached
 
 
 class CustomLLM(LLM):
     model_name: str
     max_context_length: int
     probabilities: torch.Tensor = None
+    # Keep the probabilities of the generated tokens of exllama models in probabilities
+    save_probabilities: bool = False
+    # Number of prompts an exllama model generates together. Its cache is allocated for this many sequences
+    max_batch_size: int = 1
+    # Release cached GPU memory after every HF generation. Off by default so that the allocator can reuse its pools
+    empty_cache: bool = False
+    # Peak GPU memory in bytes allocated on every device during the last call
+    peak_memory: List[int] = None
     exllama: bool = False
     load_in_8bit: bool = False
     load_in_4bit: bool = False
@@ -36,8 +51,19 @@ class CustomLLM(LLM):
     self_consistency: bool = False
 
     openai_api_key: str = None
+    # Point to a local OpenAI compatible server instead of the OpenAI API
+    openai_api_base: str = None
+    # Number of requests sent to the OpenAI API at the same time when generating for multiple prompts
+    max_concurrency: int = 8
     tags: Dict[str, str] = None
 
+    # Reuse the KV cache of the prompt prefix shared by consecutive prompts (system prompt, fewshot examples, guidelines)
+    prefix_cache: bool = False
+    prefix_cache_min_tokens: int = 32
+    prefix_ids: Any = None
+    prefix_past_key_values: Any = None
+    last_prompt_ids: Any = None
+
     @property
     def _llm_type(self) -> Any:
         return "custom"
@@ -68,8 +94,14 @@ class CustomLLM(LLM):
         if self.model_name == "Human":
             return
         elif self.openai_api_key:
-            self.tokenizer = tiktoken.encoding_for_model(self.model_name)
+            try:
+                self.tokenizer = tiktoken.encoding_for_model(self.model_name)
+            except KeyError:
+                # Models served by local OpenAI compatible servers are unknown to tiktoken
+                self.tokenizer = tiktoken.get_encoding("cl100k_base")
             openai.api_key = self.openai_api_key
+            if self.openai_api_base:
+                openai.api_base = self.openai_api_base
             return
         elif (
             self.model_name
@@ -105,7 +137,7 @@ class CustomLLM(LLM):
                 self.model = ExLlamaV2(config)
                 self.model.load()
                 self.tokenizer = ExLlamaV2Tokenizer(config)
-                cache = ExLlamaV2Cache(self.model)
+                cache = ExLlamaV2Cache(self.model, batch_size=self.max_batch_size)
                 self.generator = ExLlamaV2BaseGenerator(
                     self.model, cache, self.tokenizer
                 )
@@ -300,6 +332,22 @@ class CustomLLM(LLM):
     def completion_with_backoff(self, **kwargs):
         return openai.ChatCompletion.create(**kwargs)
 
+    @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(10))
+    async def acompletion_with_backoff(self, **kwargs):
+        return await openai.ChatCompletion.acreate(**kwargs)
+
+    def openai_request(self, prompt: str) -> Dict[str, Any]:
+        return dict(
+            model=self.model_name,
+            messages=extract_sections(
+                prompt,
+                self.tags,
+            ),
+            stop=STOP_WORDS,
+            temperature=0.0,
+            seed=self.seed,
+        )
+
     def remove_input_tokens(self, output_tokens, ids):
         # Truncate the larger tensor to match the size of the smaller one
         min_size = min(output_tokens.size(1), ids.size(1))
@@ -331,32 +379,14 @@ class CustomLLM(LLM):
             output = input(prompt)
 
         elif self.openai_api_key:
-            messages = extract_sections(
-                prompt,
-                self.tags,
-            )
-
-            response = self.completion_with_backoff(
-                model=self.model_name,
-                messages=messages,
-                stop=STOP_WORDS,
-                temperature=0.0,
-                seed=self.seed,
-            )
+            response = self.completion_with_backoff(**self.openai_request(prompt))
             output = response["choices"][0]["message"]["content"]
         elif self.exllama:
             with torch.inference_mode():
-                ids = self.tokenizer.encode(prompt, encode_special_tokens=True)
+                ids = encode_cached(self.tokenizer, prompt)
                 tokens_prompt = ids.shape[-1]
 
-                settings = ExLlamaV2Sampler.Settings()
-                if self.self_consistency:
-                    settings = settings.clone()
-                    settings.temperature = 0.7
-                    seed = None
-                else:
-                    settings = settings.greedy_clone()
-                    seed = self.seed
+                settings, seed = self.exllama_settings()
 
                 stop_criteria = create_stop_criteria_exllama(
                     stop, self.tokenizer.eos_token_id, self.tokenizer
@@ -371,6 +401,8 @@ class CustomLLM(LLM):
                     encode_special_tokens=True,
                     decode_special_tokens=False,
                     stop_criteria=stop_criteria,
+                    reuse_prefix=self.prefix_cache,
+                    save_probabilities=self.save_probabilities,
                 )
 
                 output_tokens = self.remove_input_tokens(output_tokens, ids)
@@ -378,14 +410,19 @@ class CustomLLM(LLM):
                     output_tokens, decode_special_tokens=False
                 )[0]
         else:
-            inputs = self.tokenizer(
-                prompt,
-                return_tensors="pt",
-                max_length=self.max_context_length,
-                truncation=True,
-                padding=False,
-            )
-            input_ids = inputs["input_ids"].to(self.model.device)
+            # Prompts whose tokens were counted before (e.g. by the agent) are already encoded. Only prompts that are too long need the tokenizer to truncate them
+            ids = encode_cached(self.tokenizer, prompt)
+            if len(ids) <= self.max_context_length:
+                input_ids = torch.tensor([ids], device=self.model.device)
+            else:
+                inputs = self.tokenizer(
+                    prompt,
+                    return_tensors="pt",
+                    max_length=self.max_context_length,
+                    truncation=True,
+                    padding=False,
+                )
+                input_ids = inputs["input_ids"].to(self.model.device)
 
             generation_config = GenerationConfig(
                 temperature=temperature,
@@ -402,15 +439,21 @@ class CustomLLM(LLM):
                 stop, self.tokenizer, self.model.device
             )
 
+            past_key_values = None
+            if self.prefix_cache:
+                past_key_values = self.get_prefix_past_key_values(input_ids)
+
+            # Scores hold the logits over the whole vocabulary for every step so are only kept if the probabilities are needed
             with torch.no_grad():
                 generation_output = self.model.generate(
                     input_ids=input_ids,
                     generation_config=generation_config,
                     stopping_criteria=StoppingCriteriaList([stop_criteria]),
                     return_dict_in_generate=True,
-                    output_scores=True,
+                    output_scores=self.save_probabilities,
                     max_length=self.max_context_length,
                     use_cache=True,
+                    past_key_values=past_key_values,
                 )
 
             s = generation_output.sequences
@@ -418,16 +461,252 @@ class CustomLLM(LLM):
             output = self.tokenizer.batch_decode(s_no_input, skip_special_tokens=True)[
                 0
             ]
+            if self.save_probabilities:
+                self.probabilities = self.generated_token_probabilities(
+                    generation_output.scores, s_no_input
+                )
 
             del generation_output
-            torch.cuda.empty_cache()
-
+            if self.empty_cache:
+                torch.cuda.empty_cache()
+
+        return self.postprocess_output(output, stop)
+
+    @staticmethod
+    def generated_token_probabilities(
+        scores: List[torch.Tensor], generated_ids: torch.Tensor
+    ) -> torch.Tensor:
+        # Probability of every generated token under the processed scores of its step
+        probabilities = [
+            step_scores.float().softmax(dim=-1).gather(-1, generated_ids[:, i : i + 1])
+            for i, step_scores in enumerate(scores)
+        ]
+        return torch.cat(probabilities, dim=1).cpu()
+
+    def get_prefix_past_key_values(self, input_ids: torch.Tensor) -> Any:
+        """Returns a copy of the cached KV state of the prompt prefix if the prompt starts with it. The prefix is (re)computed once the prompt shares at least prefix_cache_min_tokens tokens with the previous prompt. Prompts of other chains (i.e. summaries) in between do not replace the prefix.
+
+        Args:
+            input_ids (torch.Tensor): The tokenized prompt of shape (1, seq_len).
+
+        Returns:
+            past_key_values (Any): KV cache to continue from or None if the prompt does not start with the prefix.
+        """
+        ids = input_ids[0]
+        past_key_values = None
+        if (
+            self.prefix_ids is not None
+            and ids.shape[-1] > self.prefix_ids.shape[-1]
+            and torch.equal(ids[: self.prefix_ids.shape[-1]], self.prefix_ids)
+        ):
+            # Generate extends the cache in place so always hand out a copy
+            past_key_values = copy.deepcopy(self.prefix_past_key_values)
+        elif self.last_prompt_ids is not None:
+            # At least the last prompt token must be processed by generate itself
+            prefix_length = min(
+                common_prefix_length(self.last_prompt_ids, ids), ids.shape[-1] - 1
+            )
+            if prefix_length >= self.prefix_cache_min_tokens:
+                with torch.no_grad():
+                    prefix_output = self.model(
+                        input_ids=input_ids[:, :prefix_length], use_cache=True
+                    )
+                self.prefix_ids = ids[:prefix_length]
+                self.prefix_past_key_values = prefix_output.past_key_values
+                past_key_values = copy.deepcopy(self.prefix_past_key_values)
+        self.last_prompt_ids = ids
+        return past_key_values
+
+    def postprocess_output(self, output: str, stop: List[str]) -> str:
         # Remove observations strings from output if generated
         for stop_word in STOP_WORDS + stop:
             output = output.replace(stop_word, "")
 
         return output.strip()
 
+    def exllama_settings(self):
+        settings = ExLlamaV2Sampler.Settings()
+        if self.self_consistency:
+            settings = settings.clone()
+            settings.temperature = 0.7
+            seed = None
+        else:
+            settings = settings.greedy_clone()
+            seed = self.seed
+        return settings, seed
+
+    def supports_batching(self) -> bool:
+        # Exllama models need a cache with room for several sequences. HF models need a pad token for left padding
+        if self.model_name == "Human" or self.openai_api_key:
+            return False
+        if self.exllama:
+            return self.max_batch_size > 1
+        return getattr(self.tokenizer, "pad_token_id", None) is not None
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        self.start_memory_tracking()
+        # Langchain calls _call once per prompt. If we can, run all prompts through a single generate call instead
+        if len(prompts) > 1 and self.openai_api_key:
+            outputs = asyncio.run(self._acall_openai(prompts, stop or []))
+            result = LLMResult(generations=[[Generation(text=o)] for o in outputs])
+        elif len(prompts) > 1 and self.supports_batching():
+            if self.exllama:
+                outputs = self._call_batch_exllama(prompts, stop or [])
+            else:
+                outputs = self._call_batch(prompts, stop or [], **kwargs)
+            result = LLMResult(generations=[[Generation(text=o)] for o in outputs])
+        else:
+            result = super()._generate(
+                prompts, stop=stop, run_manager=run_manager, **kwargs
+            )
+        self.stop_memory_tracking()
+        return result
+
+    def start_memory_tracking(self) -> None:
+        self.peak_memory = None
+        if torch.cuda.is_available():
+            for device in range(torch.cuda.device_count()):
+                torch.cuda.reset_peak_memory_stats(device)
+
+    def stop_memory_tracking(self) -> None:
+        if torch.cuda.is_available():
+            self.peak_memory = [
+                torch.cuda.max_memory_allocated(device)
+                for device in range(torch.cuda.device_count())
+            ]
+
+    async def _acall_openai(self, prompts: List[str], stop: List[str]) -> List[str]:
+        # Keep at most max_concurrency requests in flight. Each request is retried on its own and outputs keep the order of the prompts
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def request(prompt):
+            async with semaphore:
+                response = await self.acompletion_with_backoff(
+                    **self.openai_request(prompt)
+                )
+            return self.postprocess_output(
+                response["choices"][0]["message"]["content"], stop
+            )
+
+        return await asyncio.gather(*(request(prompt) for prompt in prompts))
+
+    def _call_batch(
+        self,
+        prompts: List[str],
+        stop: List[str],
+        do_sample=True,
+        temperature=0.01,
+        top_k=1,
+        top_p=0.95,
+        num_beams=1,
+        repetition_penalty=1.2,
+        length_penalty=1.0,
+        **kwargs,
+    ) -> List[str]:
+        self.probabilities = None
+
+        # Left pad so that generation of all rows continues directly after their prompt
+        padding_side = self.tokenizer.padding_side
+        self.tokenizer.padding_side = "left"
+        inputs = self.tokenizer(
+            prompts,
+            return_tensors="pt",
+            max_length=self.max_context_length,
+            truncation=True,
+            padding=True,
+        )
+        self.tokenizer.padding_side = padding_side
+        input_ids = inputs["input_ids"].to(self.model.device)
+        attention_mask = inputs["attention_mask"].to(self.model.device)
+
+        generation_config = GenerationConfig(
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            num_beams=num_beams,
+            do_sample=do_sample,
+            repetition_penalty=repetition_penalty,
+            length_penalty=length_penalty,
+            **kwargs,
+        )
+
+        # Each row is stopped separately. Finished rows are filled with the pad token until all rows are done
+        stop_criteria = create_stop_criteria(stop, self.tokenizer, self.model.device)
+
+        with torch.no_grad():
+            generation_output = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                generation_config=generation_config,
+                stopping_criteria=StoppingCriteriaList([stop_criteria]),
+                return_dict_in_generate=True,
+                pad_token_id=self.tokenizer.pad_token_id,
+                max_length=self.max_context_length,
+                use_cache=True,
+            )
+
+        s = generation_output.sequences
+        s_no_input = s[:, input_ids.shape[1] :]
+        outputs = self.tokenizer.batch_decode(s_no_input, skip_special_tokens=True)
+
+        del generation_output
+        if self.empty_cache:
+            torch.cuda.empty_cache()
+
+        return [self.postprocess_output(output, stop) for output in outputs]
+
+    def _call_batch_exllama(self, prompts: List[str], stop: List[str]) -> List[str]:
+        outputs = []
+        probabilities = []
+        # The cache only has room for max_batch_size sequences
+        for start in range(0, len(prompts), self.max_batch_size):
+            batch_prompts = prompts[start : start + self.max_batch_size]
+            with torch.inference_mode():
+                # Prompts are left padded to the longest one
+                ids = self.tokenizer.encode(batch_prompts, encode_special_tokens=True)
+                tokens_prompt = ids.shape[-1]
+
+                settings, seed = self.exllama_settings()
+
+                stop_criteria = create_stop_criteria_exllama(
+                    stop, self.tokenizer.eos_token_id, self.tokenizer
+                )
+
+                # Without token healing the generated tokens of every row start directly after the padded prompts
+                output_tokens, batch_probabilities = self.generator.generate_simple(
+                    batch_prompts,
+                    gen_settings=settings,
+                    num_tokens=self.max_context_length - tokens_prompt,
+                    seed=seed,
+                    token_healing=False,
+                    encode_special_tokens=True,
+                    decode_special_tokens=False,
+                    stop_criteria=stop_criteria,
+                    save_probabilities=self.save_probabilities,
+                    input_ids=ids,
+                )
+
+                for row, length in enumerate(self.generator.generated_lengths):
+                    row_tokens = output_tokens[
+                        row : row + 1, tokens_prompt : tokens_prompt + length
+                    ]
+                    output = self.tokenizer.decode(
+                        row_tokens, decode_special_tokens=False
+                    )[0]
+                    outputs.append(self.postprocess_output(output, stop))
+                    if batch_probabilities is not None:
+                        probabilities.append(batch_probabilities[row, :length])
+
+        # One tensor of probabilities per prompt
+        self.probabilities = probabilities if self.save_probabilities else None
+        return outputs
+
     @property
     def _identifying_params(self) -> Mapping[str, Any]:
         """Get the identifying parameters."""
@@ -1,3 +1,4 @@
+from collections import deque
 from typing import List
 import torch
 from transformers import StoppingCriteria
@@ -16,6 +17,15 @@ def calculate_log_prob_confidence(probs: torch.Tensor):
     return avg_log_prob
 
 
+# Number of leading tokens two 1D token tensors have in common
+def common_prefix_length(ids_a: torch.Tensor, ids_b: torch.Tensor) -> int:
+    min_length = min(ids_a.shape[-1], ids_b.shape[-1])
+    mismatches = (ids_a[:min_length] != ids_b[:min_length]).nonzero()
+    if len(mismatches) > 0:
+        return mismatches[0, 0].item()
+    return min_length
+
+
 def create_stop_criteria(stop_words: List[str], tokenizer, device) -> StoppingCriteria:
     stop_ids = [
         tokenizer.encode(w, add_special_tokens=False, return_tensors="pt").to(device)
@@ -45,14 +55,100 @@ def create_stop_criteria_exllama(
     return KeywordsStoppingCriteria(stop_ids)
 
 
+# Aho-Corasick automaton over token ids. The state is the longest suffix of the tokens fed so far that is a prefix of a stop sequence, so a stop sequence ends at the last token exactly when the state is terminal
+class StopSequenceMatcher:
+    def __init__(self, sequences: List[List[int]]):
+        self.children = [{}]
+        self.terminal = [False]
+        for sequence in sequences:
+            if len(sequence) == 0:
+                continue
+            state = 0
+            for token in sequence:
+                if token not in self.children[state]:
+                    self.children[state][token] = len(self.children)
+                    self.children.append({})
+                    self.terminal.append(False)
+                state = self.children[state][token]
+            self.terminal[state] = True
+        self.max_length = max((len(s) for s in sequences), default=0)
+
+        # Failure links point to the longest proper suffix that is also in the trie. Built breadth first so that shorter suffixes are done first
+        self.fail = [0] * len(self.children)
+        queue = deque(self.children[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, child in self.children[state].items():
+                queue.append(child)
+                fail = self.fail[state]
+                while fail and token not in self.children[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.children[fail].get(token, 0)
+                self.terminal[child] = (
+                    self.terminal[child] or self.terminal[self.fail[child]]
+                )
+
+        # Transitions are resolved through the failure links once and then looked up directly
+        self.transitions = [dict(children) for children in self.children]
+
+    def step(self, state: int, token: int) -> int:
+        transitions = self.transitions[state]
+        if token in transitions:
+            return transitions[token]
+        fallback = state
+        while fallback and token not in self.children[fallback]:
+            fallback = self.fail[fallback]
+        next_state = self.children[fallback].get(token, 0)
+        transitions[token] = next_state
+        return next_state
+
+    def feed(self, state: int, tokens: List[int]) -> int:
+        for token in tokens:
+            state = self.step(state, token)
+        return state
+
+
+# Checks every row of a batch separately and only feeds the newly generated token to the matcher. A row stays done once a stop sequence was generated. HF generate fills done rows with the pad token and ends generation when all rows are done
 class KeywordsStoppingCriteria(StoppingCriteria):
-    def __init__(self, keywords: torch.Tensor):
+    def __init__(self, keywords: List[torch.Tensor]):
         self.keywords = keywords
+        self.matcher = StopSequenceMatcher([k.tolist() for k in keywords])
+        self.states = []
+        self.is_done = []
+        self.last_tokens = []
+        self.length = 0
 
     def __call__(
         self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs
-    ) -> bool:
-        for k in self.keywords:
-            if torch.equal(input_ids[0][-len(k) :], k):
-                return True
-        return False
+    ) -> torch.BoolTensor:
+        batch_size, length = input_ids.shape
+        window = input_ids[:, -2:].tolist()
+
+        # One token was generated for the same rows since the last call
+        if (
+            length == self.length + 1
+            and batch_size == len(self.states)
+            and all(
+                len(row) == 2 and row[0] == last
+                for row, last in zip(window, self.last_tokens)
+            )
+        ):
+            for row in range(batch_size):
+                self.states[row] = self.matcher.step(
+                    self.states[row], window[row][-1]
+                )
+                self.is_done[row] = (
+                    self.is_done[row] or self.matcher.terminal[self.states[row]]
+                )
+        # New sequences. The state only depends on the last max_length tokens
+        else:
+            if self.matcher.max_length > 0:
+                tails = input_ids[:, -self.matcher.max_length :].tolist()
+            else:
+                tails = [[] for _ in range(batch_size)]
+            self.states = [self.matcher.feed(0, tail) for tail in tails]
+            self.is_done = [self.matcher.terminal[state] for state in self.states]
+
+        self.length = length
+        self.last_tokens = [row[-1] for row in window]
+        return torch.tensor(self.is_done, dtype=torch.bool, device=input_ids.device)
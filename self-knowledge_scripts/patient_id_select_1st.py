@@ -8,7 +8,7 @@ import hydra
 from omegaconf import DictConfig
 
 from dataset.utils import load_hadm_from_file
-from utils.logging import read_from_pickle_file
+from utils.results_store import ResultsStore
 
 evals_path = "" # path to the evaluation results witr model name
 output_path = "" # path to save the correct patient IDs and diagnoses
@@ -79,10 +79,10 @@ def create_correct_id_info():
             correct_diagnoses = []
             all_results = []
             # Load the diagnoses results of all patients
-            for r in read_from_pickle_file(glob.glob(results_log_path)[0]):
-                for k, v in r.items():
-                    if k in patients_ids:
-                        all_results.append(v)
+            results = ResultsStore(glob.glob(results_log_path)[0]).load_all()
+            for k, v in results.items():
+                if k in patients_ids:
+                    all_results.append(v)
             n = 3     
             for i in range(n):
                 if len(all_results) >= 30:
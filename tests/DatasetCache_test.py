@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+from os.path import join
+
+import pandas as pd
+
+from dataset.cache import load_cached_table
+
+
+class TestDatasetCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = join(self.tmp_dir.name, "cache")
+        self.source = join(self.tmp_dir.name, "labevents.csv")
+        with open(self.source, "w") as f:
+            f.write("hadm_id,charttime,value\n1,2150-01-01 10:00:00,7\n2,,NEG\n")
+        self.builds = 0
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def build(self):
+        self.builds += 1
+        df = pd.read_csv(self.source)
+        df["charttime"] = pd.to_datetime(df["charttime"])
+        return df
+
+    def load(self, columns=None):
+        return load_cached_table(
+            self.cache_dir, "labevents", [self.source], self.build, columns=columns
+        )
+
+    def test_cache_is_reused(self):
+        built = self.load()
+        cached = self.load()
+
+        self.assertEqual(self.builds, 1)
+        pd.testing.assert_frame_equal(cached, built)
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(cached["charttime"]))
+
+    def test_cache_invalidated_by_source_change(self):
+        self.load()
+        with open(self.source, "a") as f:
+            f.write("3,2150-01-02 10:00:00,8\n")
+
+        df = self.load()
+
+        self.assertEqual(self.builds, 2)
+        self.assertEqual(len(df), 3)
+
+    def test_cache_columns(self):
+        self.load()
+
+        df = self.load(columns=["hadm_id", "value"])
+
+        self.assertEqual(df.columns.tolist(), ["hadm_id", "value"])
+        self.assertEqual(df["value"].tolist(), ["7", "NEG"])
+
+    def test_cached_and_uncached_tables_equal(self):
+        # Values of a column that pandas parsed partly as numbers and partly as strings
+        def build():
+            self.builds += 1
+            df = pd.read_csv(self.source)
+            df["charttime"] = pd.to_datetime(df["charttime"])
+            df["value"] = pd.Series([7, "NEG"], dtype=object)
+            return df
+
+        uncached = load_cached_table(None, "labevents", [self.source], build)
+        built = load_cached_table(self.cache_dir, "labevents", [self.source], build)
+        cached = load_cached_table(self.cache_dir, "labevents", [self.source], build)
+
+        self.assertEqual(self.builds, 2)
+        pd.testing.assert_frame_equal(built, uncached)
+        pd.testing.assert_frame_equal(cached, uncached)
+        self.assertEqual(uncached["value"].tolist(), ["7", "NEG"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,177 @@
+import os
+import tempfile
 import unittest
+
+import numpy as np
+import pandas as pd
+
 from dataset.discharge import extract_diagnosis_from_discharge
+from dataset.dataset import (
+    create_valuestr_lab,
+    create_valuestr_microbio,
+    create_valuestr_lab_column,
+    create_valuestr_microbio_column,
+    fill_nan_hadm,
+    extract_hadm_info,
+    extract_info,
+    EXTRACTION_COLUMNS,
+)
+
+
+HISTORY_NOTE = """Chief Complaint:
+abdominal pain
+ 
+Major Surgical or Invasive Procedure:
+Laparoscopic appendectomy
+ 
+History of Present Illness:
+Patient {} presents with right lower quadrant pain.
+ 
+Physical Exam:
+Tender in the right lower quadrant, no rebound, no guarding.
+ 
+Pertinent Results:
+WBC 15.0
+ 
+Discharge Diagnosis:
+Acute appendicitis
+ 
+Discharge Condition:
+good"""
+
+# Tables in the order extract_hadm_info takes them
+EXTRACTION_TABLES = [
+    "discharge",
+    "admissions",
+    "transfers",
+    "labevents",
+    "microbiologyevents",
+    "radiology",
+    "radiology_detail",
+]
+
+
+# Small cohort with the columns of the MIMIC tables, including columns the extraction does not use. extract_hadm_info converts the datetime columns in place so every run needs new frames
+def extraction_frames(tables, columns=None):
+    frames = {
+        "discharge": pd.DataFrame(
+            {
+                "note_id": ["1-DS-1", "2-DS-1", "3-DS-1"],
+                "subject_id": [1, 2, 3],
+                "hadm_id": [10, 20, 30],
+                "note_type": ["DS", "DS", "DS"],
+                "text": [
+                    HISTORY_NOTE.format(1),
+                    HISTORY_NOTE.format(2),
+                    "Discharge note without history",
+                ],
+            }
+        ),
+        "admissions": pd.DataFrame(
+            {
+                "subject_id": [1, 2, 3, 4],
+                "hadm_id": [10, 20, 30, 40],
+                "admittime": ["2150-01-01", "2150-02-01", "2150-03-01", "2150-04-01"],
+                "dischtime": ["2150-01-05", "2150-02-05", "2150-03-05", "2150-04-05"],
+            }
+        ),
+        "transfers": pd.DataFrame(
+            {
+                "subject_id": [1, 2, 3, 4],
+                "hadm_id": [10, 20, 30, 40],
+                "transfer_id": [100, 200, 300, 400],
+                "careunit": ["Emergency Department"] * 4,
+                "intime": ["2150-01-01", "2150-02-01", "2150-03-01", "2150-04-01"],
+            }
+        ),
+        "labevents": pd.DataFrame(
+            {
+                "labevent_id": [1, 2, 3, 4, 5],
+                "subject_id": [1, 1, 1, 2, 2],
+                "hadm_id": [10, 10, np.nan, 20, 20],
+                "itemid": [51301, 51301, 50931, 50867, 50956],
+                "charttime": [
+                    "2150-01-02 10:00",
+                    "2150-01-02 08:00",
+                    "2150-01-01 12:00",
+                    "2150-02-02 08:00",
+                    "2150-02-02 08:00",
+                ],
+                "valuestr": ["14.2 K/uL", "15.0 K/uL", "110 mg/dL", "___", "40 IU/L"],
+                "valueuom": ["K/uL", "K/uL", "mg/dL", "IU/L", "IU/L"],
+                "ref_range_lower": [4.0, 4.0, 70.0, 0.0, 0.0],
+                "ref_range_upper": [11.0, 11.0, 100.0, 100.0, 60.0],
+                "label": ["WBC", "WBC", "Glucose", "Amylase", "Lipase"],
+            }
+        ),
+        "microbiologyevents": pd.DataFrame(
+            {
+                "microevent_id": [1, 2, 3],
+                "subject_id": [1, 1, 2],
+                "hadm_id": [10, 10, 20],
+                "charttime": ["2150-01-02", "2150-01-02", "2150-02-02"],
+                "spec_itemid": [70012, 70012, 70079],
+                "test_itemid": [90201, 90201, 90039],
+                "org_itemid": [80002, 80023, np.nan],
+                "org_name": ["E. coli", "Klebsiella", np.nan],
+                "valuestr": ["E. coli", "Klebsiella", "No growth"],
+            }
+        ),
+        "radiology": pd.DataFrame(
+            {
+                "note_id": ["1-RR-1", "1-RR-2", "2-RR-1"],
+                "subject_id": [1, 1, 2],
+                "hadm_id": [10, 10, 20],
+                "note_type": ["RR", "RR", "RR"],
+                "charttime": ["2150-01-01", "2150-01-02", "2150-02-01"],
+                "text": [
+                    "EXAMINATION: CT ABDOMEN AND PELVIS\n\nFINDINGS: Dilated appendix.",
+                    "EXAMINATION: US ABDOMEN\n\nFINDINGS: Normal gallbladder.",
+                    "EXAMINATION: CHEST (PA AND LAT)\n\nFINDINGS: No consolidation.",
+                ],
+            }
+        ),
+        "radiology_detail": pd.DataFrame(
+            {
+                "note_id": ["1-RR-1", "1-RR-2", "1-RR-2", "2-RR-1"],
+                "subject_id": [1, 1, 1, 2],
+                "field_name": ["exam_name", "exam_name", "parent_note_id", "exam_name"],
+                "field_value": [
+                    "CT ABD & PELVIS WITH CONTRAST",
+                    "US ABD LIMIT, SINGLE ORGAN",
+                    "1-RR-1",
+                    "CHEST (PA & LAT)",
+                ],
+                "field_ordinal": [1, 1, 1, 1],
+            }
+        ),
+        "diagnoses_icd": pd.DataFrame(
+            {
+                "subject_id": [1, 2],
+                "hadm_id": [10, 20],
+                "icd_code": ["K3580", "K3580"],
+                "icd_version": [10, 10],
+                "long_title": ["Other and unspecified acute appendicitis"] * 2,
+            }
+        ),
+        "procedures_icd": pd.DataFrame(
+            {
+                "subject_id": [1, 2],
+                "hadm_id": [10, 20],
+                "icd_code": ["0DTJ4ZZ", "4701"],
+                "icd_version": [10, 9],
+                "long_title": [
+                    "Resection of Appendix, Percutaneous Endoscopic Approach",
+                    "Laparoscopic appendectomy",
+                ],
+            }
+        ),
+    }
+    columns = columns or {}
+    return [
+        frames[table][columns[table]] if table in columns else frames[table]
+        for table in tables
+    ]
 
 
 class TestDataset(unittest.TestCase):
@@ -145,5 +317,143 @@ Gastroesophageal Reflux Disease"""
         self.assertEqual(output, expected)
 
 
+    def test_create_valuestr_lab_column(self):
+        lab_events_df = pd.DataFrame(
+            [
+                (7.0, "7", "mg/dL", np.nan, np.nan),
+                (0.1, "0.1", np.nan, "abnormal", np.nan),
+                (1e-05, "1e-05", "K/uL", np.nan, "Comment"),
+                (123456789.123, "x", "%", np.nan, np.nan),
+                (np.nan, "NEG", "mg/dL", np.nan, np.nan),
+                (np.nan, "___", np.nan, "abnormal", "Comment"),
+                (np.nan, "___", "mg/dL", np.nan, "___"),
+                (np.nan, np.nan, np.nan, np.nan, np.nan),
+                (np.nan, np.nan, "IU/L", "abnormal", "Comment"),
+                (12.5, "12.5", np.nan, np.nan, np.nan),
+            ],
+            columns=["valuenum", "value", "valueuom", "flag", "comments"],
+            index=[3, 5, 8, 9, 10, 11, 12, 20, 21, 22],
+        )
+        expected = lab_events_df.apply(create_valuestr_lab, axis=1)
+        output = create_valuestr_lab_column(lab_events_df)
+        self.assertEqual(output.index.tolist(), expected.index.tolist())
+        for o, e in zip(output.tolist(), expected.tolist()):
+            if e != e:
+                self.assertTrue(o != o)
+            else:
+                self.assertEqual(o, e)
+
+    def test_create_valuestr_microbio_column(self):
+        microbiology_df = pd.DataFrame(
+            {
+                "org_name": ["E. COLI", np.nan, np.nan],
+                "comments": ["Comment", "NO GROWTH", np.nan],
+            },
+            index=[2, 4, 7],
+        )
+        expected = microbiology_df.apply(create_valuestr_microbio, axis=1)
+        output = create_valuestr_microbio_column(microbiology_df)
+        self.assertEqual(output.iloc[:2].tolist(), expected.iloc[:2].tolist())
+        self.assertTrue(output.iloc[2] != output.iloc[2])
+        self.assertTrue(expected.iloc[2] != expected.iloc[2])
+
+
+    def test_fill_nan_hadm(self):
+        transfers_df = pd.DataFrame(
+            {
+                "hadm_id": [10, 10, 11, 20],
+                "intime": pd.to_datetime(
+                    [
+                        "2150-01-05 00:00",
+                        "2150-01-02 00:00",
+                        "2150-01-04 00:00",
+                        "2150-03-01 00:00",
+                    ]
+                ),
+            }
+        )
+        hadm_to_subject_id = {10: 1, 11: 1, 20: 2}
+
+        def events():
+            return pd.DataFrame(
+                {
+                    "subject_id": [1, 1, 1, 1, 1, 2, 2],
+                    "hadm_id": [np.nan, np.nan, 99, np.nan, np.nan, np.nan, np.nan],
+                    "charttime": pd.to_datetime(
+                        [
+                            "2150-01-01 00:00",  # One day before first transfer of 10
+                            "2150-01-03 12:00",  # In windows of 10 and 11
+                            "2150-01-03 00:00",  # Already has a hadm_id
+                            "2150-01-05 00:01",  # After last transfer of 10 and 11
+                            "2149-12-31 23:59",  # Before window
+                            "2150-02-28 12:00",
+                            None,
+                        ]
+                    ),
+                },
+                index=[7, 3, 5, 1, 0, 9, 8],
+            )
+
+        lab_events_df, radiology_df, microbiology_df = fill_nan_hadm(
+            events(), events(), events(), [11, 10, 20], transfers_df, hadm_to_subject_id
+        )
+
+        expected = [10, 11, 99, np.nan, np.nan, 20, np.nan]
+        for df in [lab_events_df, radiology_df, microbiology_df]:
+            np.testing.assert_array_equal(df["hadm_id"].values, expected)
+
+    def test_extract_hadm_info_workers(self):
+        disease_ids = [20, 10, 30, 40]
+        serial = extract_hadm_info(
+            disease_ids, *extraction_frames(EXTRACTION_TABLES), num_workers=1
+        )
+        parallel = extract_hadm_info(
+            disease_ids, *extraction_frames(EXTRACTION_TABLES), num_workers=2
+        )
+
+        self.assertEqual(list(serial), [20, 10])
+        self.assertEqual(list(parallel), list(serial))
+        self.assertEqual(parallel, serial)
+        self.assertEqual(serial[10]["Laboratory Tests"][51301], "15.0 K/uL")
+        self.assertEqual(
+            [rad["Exam Name"] for rad in serial[10]["Radiology"]],
+            ["CT ABD & PELVIS WITH CONTRAST", "US ABD LIMIT, SINGLE ORGAN"],
+        )
+
+    def test_extract_info_extraction_columns(self):
+        tables = EXTRACTION_TABLES + ["diagnoses_icd", "procedures_icd"]
+
+        def extract(columns):
+            frames = dict(zip(tables, extraction_frames(tables, columns)))
+            return extract_info(
+                [20, 10, 30, 40],
+                "appendicitis",
+                ["appendicitis"],
+                frames["discharge"],
+                frames["admissions"],
+                frames["transfers"],
+                frames["labevents"],
+                frames["microbiologyevents"],
+                frames["radiology"],
+                frames["radiology_detail"],
+                frames["diagnoses_icd"],
+                frames["procedures_icd"],
+            )
+
+        # extract_info writes its results to the working directory
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)
+            try:
+                full = extract(None)
+                pruned = extract(EXTRACTION_COLUMNS)
+            finally:
+                os.chdir(cwd)
+
+        self.assertIsNotNone(full[1])
+        self.assertEqual(sorted(full[0]), [10, 20])
+        self.assertEqual(pruned, full)
+
+
 if __name__ == "__main__":
     unittest.main()
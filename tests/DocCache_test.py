@@ -0,0 +1,66 @@
+import unittest
+
+import utils.nlp
+from utils.nlp import DocCache
+
+
+# Stands in for the spaCy pipeline and records which texts were parsed
+class FakeNLP:
+    def __init__(self):
+        self.parsed = []
+
+    def __call__(self, text):
+        self.parsed.append(text)
+        return f"doc({text})"
+
+    def pipe(self, texts, batch_size=64):
+        for text in texts:
+            yield self(text)
+
+
+class TestDocCache(unittest.TestCase):
+    def setUp(self):
+        self.nlp = FakeNLP()
+        self.original_nlp = utils.nlp._nlp
+        utils.nlp._nlp = self.nlp
+        self.cache = DocCache(maxsize=2)
+
+    def tearDown(self):
+        utils.nlp._nlp = self.original_nlp
+
+    def test_get_parses_once(self):
+        self.assertEqual(self.cache.get("No appendicitis"), "doc(No appendicitis)")
+        self.assertEqual(self.cache.get("No appendicitis"), "doc(No appendicitis)")
+
+        self.assertEqual(self.nlp.parsed, ["No appendicitis"])
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_lru_eviction(self):
+        self.cache.get("a")
+        self.cache.get("b")
+        self.cache.get("a")
+        self.cache.get("c")
+
+        self.assertEqual(list(self.cache.docs), ["a", "c"])
+        self.cache.get("b")
+        self.assertEqual(self.nlp.parsed, ["a", "b", "c", "b"])
+
+    def test_pipe(self):
+        self.cache.get("a")
+        docs = self.cache.pipe(["a", "b", "b"])
+
+        self.assertEqual(docs, ["doc(a)", "doc(b)", "doc(b)"])
+        self.assertEqual(self.nlp.parsed, ["a", "b"])
+        self.assertEqual(self.cache.stats()["hits"], 2)
+        self.assertEqual(self.cache.stats()["misses"], 2)
+
+    def test_pipe_more_than_maxsize(self):
+        docs = self.cache.pipe(["a", "b", "c"])
+
+        self.assertEqual(docs, ["doc(a)", "doc(b)", "doc(c)"])
+        self.assertEqual(len(self.cache.docs), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
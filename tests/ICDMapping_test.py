@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from os.path import join
+
+import icd.procedure_mappings as procedure_mappings
+from icd.procedure_mappings import (
+    ICDMappingService,
+    icd_converter,
+    get_title_from_code,
+    parse_icd_mapping_file,
+)
+
+
+class TestICDMapping(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.paths = [
+            join(self.tmp_dir, name)
+            for name in [
+                "icd9_names.txt",
+                "icd10_names.txt",
+                "gem_i9pcs.txt",
+                "gem_pcsi9.txt",
+            ]
+        ]
+        self.write(0, ["4701 Laparoscopic appendectomy", "4709 Other appendectomy"])
+        self.write(
+            1,
+            [
+                "0DTJ4ZZ Resection of Appendix, Percutaneous Endoscopic Approach",
+                "0DTJ0ZZ Resection of Appendix, Open Approach",
+            ],
+        )
+        self.write(2, ["4701  0DTJ4ZZ 10000", "4709  0DTJ0ZZ 10000", "4709  0DTJ7ZZ 10000"])
+        self.write(3, ["0DTJ4ZZ 4701  10000", "0DTJ0ZZ 4709  10000"])
+        procedure_mappings._icd_tables.clear()
+
+    def tearDown(self):
+        procedure_mappings._icd_tables.clear()
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, index, lines):
+        with open(self.paths[index], "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def test_convert_matches_icd_converter(self):
+        service = ICDMappingService(*self.paths)
+        codes, titles = icd_converter(["4709", "9999"], 9, *self.paths)
+        self.assertEqual(codes, ["0DTJ0ZZ"])
+        self.assertEqual(titles, ["Resection of Appendix, Open Approach"])
+        self.assertEqual(service.convert(["4709", "9999"], 9), (codes, titles))
+        self.assertEqual(
+            service.convert_many([["0DTJ4ZZ"], ["0DTJ0ZZ", "0DTJ4ZZ"]], 10),
+            [
+                (["4701"], ["Laparoscopic appendectomy"]),
+                (["4709", "4701"], ["Other appendectomy", "Laparoscopic appendectomy"]),
+            ],
+        )
+
+    def test_get_title_from_code(self):
+        self.assertEqual(
+            get_title_from_code("4701", 9, self.paths[0], self.paths[1]),
+            "Laparoscopic appendectomy",
+        )
+        self.assertEqual(
+            get_title_from_code("0DTJ0ZZ", 10, self.paths[0], self.paths[1]),
+            "Resection of Appendix, Open Approach",
+        )
+
+    def test_binary_cache(self):
+        icd_converter(["4701"], 9, *self.paths)
+        self.assertTrue(os.path.exists(self.paths[2] + ".pkl"))
+
+        # A fresh process reads the cache instead of parsing the text file again
+        procedure_mappings._icd_tables.clear()
+        with mock.patch.object(
+            procedure_mappings, "parse_icd_mapping_file", side_effect=AssertionError
+        ):
+            self.assertEqual(
+                icd_converter(["4701"], 9, *self.paths)[0], ["0DTJ4ZZ"]
+            )
+
+        # Changing the mapping file invalidates the cache
+        procedure_mappings._icd_tables.clear()
+        self.write(2, ["4701  0DTJ0ZZ 10000"])
+        self.assertEqual(
+            icd_converter(["4701"], 9, *self.paths)[0],
+            ["0DTJ0ZZ"],
+        )
+        self.assertEqual(
+            procedure_mappings.load_cached_icd_file(
+                self.paths[2], parse_icd_mapping_file
+            ),
+            {"4701": ["0DTJ0ZZ"]},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import json
+import subprocess
+import sys
+import unittest
+
+# Importing utils.nlp must not load the spaCy pipeline or the tokenizer libraries
+HEAVY_MODULES = ["spacy", "negspacy", "nltk", "exllamav2", "tiktoken", "transformers"]
+IMPORT_TIME_BUDGET = 5.0
+
+IMPORT_SCRIPT = """
+import json
+import sys
+import time
+
+start = time.perf_counter()
+import utils.nlp
+duration = time.perf_counter() - start
+
+print(json.dumps({"duration": duration, "modules": sorted(sys.modules)}))
+"""
+
+
+class TestImportBudget(unittest.TestCase):
+    def setUp(self):
+        # Run in a fresh interpreter so that modules imported by other tests do not count
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        self.result = json.loads(output.strip().splitlines()[-1])
+
+    def test_no_heavy_modules_loaded(self):
+        loaded = [
+            module
+            for module in HEAVY_MODULES
+            if module in self.result["modules"]
+        ]
+        self.assertEqual(loaded, [])
+
+    def test_import_time(self):
+        self.assertLess(self.result["duration"], IMPORT_TIME_BUDGET)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from thefuzz import process, fuzz
+
+from utils.nlp import LabNameResolver, get_lab_name_resolver, convert_labs_to_itemid
+
+
+class TestLabNameResolver(unittest.TestCase):
+    def setUp(self):
+        self.lab_test_mapping_df = pd.DataFrame(
+            {
+                "label": [
+                    "Amylase",
+                    "Lipase",
+                    "Glucose",
+                    "Glucose",
+                    "White Blood Cells",
+                    "Blood Culture",
+                    "I",
+                    "Complete Blood Count (CBC)",
+                ],
+                "fluid": [
+                    "Blood",
+                    "Blood",
+                    "Blood",
+                    "Urine",
+                    "Blood",
+                    np.nan,
+                    "Blood",
+                    "Blood",
+                ],
+                "itemid": [50867, 50956, 50931, 51478, 51301, 90201, 50000, np.nan],
+                "corresponding_ids": [
+                    [50867],
+                    [50956],
+                    [50931, 51478],
+                    [51478],
+                    [51301],
+                    [90201],
+                    [50000],
+                    [51301, 50000],
+                ],
+            }
+        )
+        self.resolver = LabNameResolver(self.lab_test_mapping_df)
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def test_extract_one_matches_thefuzz(self):
+        labels = self.lab_test_mapping_df["label"].tolist()
+        for test in [
+            "Amylase",
+            "amylasee",
+            "Lipase, serum",
+            "glucose",
+            "WBC",
+            "White blood cell count",
+            "i",
+            "CBC",
+            "Blood cultures",
+            "Amylase Dehydrogenase",
+        ]:
+            self.assertEqual(
+                self.resolver.extract_one(test, self.resolver.labels),
+                process.extractOne(test, labels, scorer=fuzz.ratio),
+            )
+
+    def test_extract_one_empty_query(self):
+        resolver = LabNameResolver(
+            pd.concat(
+                [
+                    self.lab_test_mapping_df,
+                    pd.DataFrame(
+                        {
+                            "label": ["--"],
+                            "fluid": ["Blood"],
+                            "itemid": [50001],
+                            "corresponding_ids": [[50001]],
+                        }
+                    ),
+                ],
+                ignore_index=True,
+            )
+        )
+        for test in ["", "?!", "--"]:
+            self.assertEqual(resolver.extract_one(test, resolver.labels), ("", 0))
+        self.assertEqual(resolver.convert(["?!"]), ["?!"])
+
+    def test_convert_fluid(self):
+        self.assertEqual(
+            self.resolver.convert(["Urine Glucose", "Glucose"]), [51478, 50931, 51478]
+        )
+
+    def test_convert_no_match(self):
+        self.assertEqual(
+            self.resolver.convert(["Amylase Dehydrogenase", "Amylasee"]),
+            ["Amylase Dehydrogenase", 50867],
+        )
+        with open("no_canonical_names.txt") as f:
+            self.assertEqual(f.read(), "Amylase Dehydrogenase\n")
+
+    def test_resolver_built_once_per_mapping(self):
+        resolver = get_lab_name_resolver(self.lab_test_mapping_df)
+        self.assertIs(get_lab_name_resolver(self.lab_test_mapping_df), resolver)
+        self.assertEqual(convert_labs_to_itemid(["Lipase"], self.lab_test_mapping_df), [50956])
+        self.assertIn("Lipase", resolver.memo)
+
+
+if __name__ == "__main__":
+    unittest.main()
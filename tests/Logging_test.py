@@ -0,0 +1,76 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+from utils.logging import (
+    append_to_pickle_file,
+    read_from_pickle_file,
+    load_completed_ids,
+    merge_pickle_files,
+)
+
+
+class TestLogging(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.results_path = os.path.join(self.tmp_dir.name, "results.pkl")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_truncated_record(self):
+        append_to_pickle_file(self.results_path, {1: "Appendicitis"})
+        append_to_pickle_file(self.results_path, {2: "Cholecystitis"})
+        record = pickle.dumps({3: "Pancreatitis"})
+        with open(self.results_path, "ab") as f:
+            f.write(record[: len(record) // 2])
+
+    def test_load_completed_ids(self):
+        append_to_pickle_file(self.results_path, {1: "Appendicitis"})
+        append_to_pickle_file(self.results_path, {2: "Cholecystitis"})
+
+        self.assertEqual(load_completed_ids(self.results_path), {1, 2})
+
+    def test_load_completed_ids_missing_file(self):
+        self.assertEqual(load_completed_ids(self.results_path), set())
+
+    def test_load_completed_ids_truncated(self):
+        self.write_truncated_record()
+
+        self.assertEqual(load_completed_ids(self.results_path), {1, 2})
+
+        # Truncated record is removed so appending after resuming keeps the file readable
+        append_to_pickle_file(self.results_path, {3: "Pancreatitis"})
+        records = list(read_from_pickle_file(self.results_path))
+        self.assertEqual(
+            records, [{1: "Appendicitis"}, {2: "Cholecystitis"}, {3: "Pancreatitis"}]
+        )
+
+    def test_read_from_pickle_file_truncated(self):
+        self.write_truncated_record()
+
+        records = list(read_from_pickle_file(self.results_path))
+        self.assertEqual(records, [{1: "Appendicitis"}, {2: "Cholecystitis"}])
+
+    def test_merge_pickle_files(self):
+        shard_paths = [
+            os.path.join(self.tmp_dir.name, f"results_shard{i}of2.pkl")
+            for i in range(2)
+        ]
+        append_to_pickle_file(self.results_path, {1: "Appendicitis"})
+        append_to_pickle_file(shard_paths[0], {1: "Appendicitis"})
+        append_to_pickle_file(shard_paths[0], {3: "Pancreatitis"})
+        append_to_pickle_file(shard_paths[1], {2: "Cholecystitis"})
+
+        num_merged = merge_pickle_files(shard_paths, self.results_path)
+
+        self.assertEqual(num_merged, 2)
+        records = list(read_from_pickle_file(self.results_path))
+        self.assertEqual(
+            records, [{1: "Appendicitis"}, {3: "Pancreatitis"}, {2: "Cholecystitis"}]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
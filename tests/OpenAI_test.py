@@ -0,0 +1,119 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from models.models import CustomLLM
+
+
+# Minimal OpenAI compatible chat completion server that answers with the user message
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        content = request["messages"][-1]["content"]
+
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            fail = content in server.fail_once
+            server.fail_once.discard(content)
+        # Later prompts answer first so that the order of the outputs has to be restored
+        time.sleep(server.delays.get(content, 0))
+        with server.lock:
+            server.in_flight -= 1
+
+        if fail:
+            self.send_response(500)
+            body = {"error": {"message": "Server error", "type": "server_error"}}
+        else:
+            self.send_response(200)
+            body = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": 0,
+                "model": request["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+        body = json.dumps(body).encode()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestOpenAI(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.lock = threading.Lock()
+        self.server.in_flight = 0
+        self.server.max_in_flight = 0
+        self.server.fail_once = set()
+        self.server.delays = {}
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        self.tags = {
+            "system_tag_start": "<|im_start|>system",
+            "user_tag_start": "<|im_start|>user",
+            "ai_tag_start": "<|im_start|>assistant",
+            "system_tag_end": "<|im_end|>",
+            "user_tag_end": "<|im_end|>",
+            "ai_tag_end": "<|im_end|>",
+        }
+        self.llm = CustomLLM(
+            model_name="gpt-4",
+            openai_api_key="stub",
+            openai_api_base=f"http://127.0.0.1:{self.server.server_port}/v1",
+            max_concurrency=4,
+            tags=self.tags,
+            max_context_length=4096,
+            seed=2023,
+        )
+        self.llm.load_model("")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def prompt(self, text):
+        return f"{self.tags['user_tag_start']}{text}{self.tags['user_tag_end']}{self.tags['ai_tag_start']}"
+
+    def test_generate_keeps_order(self):
+        texts = [f"Patient {i}" for i in range(12)]
+        self.server.delays = {text: 0.05 * (12 - i) for i, text in enumerate(texts)}
+
+        result = self.llm.generate([self.prompt(text) for text in texts])
+
+        self.assertEqual([g[0].text for g in result.generations], texts)
+
+    def test_generate_limits_concurrency(self):
+        texts = [f"Patient {i}" for i in range(12)]
+        self.server.delays = {text: 0.1 for text in texts}
+
+        self.llm.generate([self.prompt(text) for text in texts])
+
+        self.assertEqual(self.server.max_in_flight, 4)
+
+    def test_generate_retries_failed_request(self):
+        texts = ["Patient 0", "Patient 1"]
+        self.server.fail_once = {"Patient 1"}
+
+        result = self.llm.generate([self.prompt(text) for text in texts])
+
+        self.assertEqual([g[0].text for g in result.generations], texts)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -999,6 +999,41 @@ It is important to note that the patient's history of malignant melanoma and rec
 
         self.assertEqual(eval["scores"]["Rounds"], 5)
 
+    #########
+    # RESET #
+    #########
+
+    def test_reset(self):
+        action = AgentAction(
+            tool="Laboratory Tests",
+            tool_input={"action_input": [51301, 12345]},
+            log="",
+            custom_parsings=0,
+        )
+        eval = self.evaluator._evaluate_agent_trajectory(
+            prediction="Final Diagnosis: Acute Appendicitis",
+            input="",
+            reference=self.base_app_reference,
+            agent_trajectory=[(action, "")],
+        )
+
+        self.evaluator.reset()
+
+        self.assertEqual(self.evaluator.answers, AppendicitisEvaluator().answers)
+        self.assertEqual(self.evaluator.scores, AppendicitisEvaluator().scores)
+        # The evaluation of the previous patient is left untouched
+        self.assertEqual(eval["scores"]["Laboratory Tests"], 1)
+        self.assertEqual(eval["answers"]["Unnecessary Laboratory Tests"], [12345])
+
+    def test_neutral_lab_tests_exclude_required(self):
+        for test in self.evaluator.required_lab_tests["Inflammation"]:
+            self.assertNotIn(test, self.evaluator.neutral_lab_tests)
+            self.assertNotIn(test, self.evaluator.neutral_lab_test_set)
+        self.assertEqual(
+            self.evaluator.neutral_lab_test_set,
+            frozenset(self.evaluator.neutral_lab_tests),
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,167 @@
+import multiprocessing
+import os
+import pickle
+import tempfile
+import unittest
+
+from utils.logging import (
+    append_to_pickle_file,
+    read_from_pickle_file,
+    merge_pickle_files,
+)
+from utils.results_store import ResultsStore, build_index
+
+
+def append_results(path, ids):
+    store = ResultsStore(path)
+    for _id in ids:
+        store.append({_id: f"Diagnosis {_id}"})
+
+
+class TestResultsStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.results_path = os.path.join(self.tmp_dir.name, "results.pkl")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_append_and_get(self):
+        store = ResultsStore(self.results_path)
+        store.append({1: "Appendicitis"})
+        store.append({2: "Cholecystitis", 3: "Pancreatitis"})
+        store.append({1: "Diverticulitis"})
+
+        # A new store reads the index written by the first one
+        store = ResultsStore(self.results_path)
+        self.assertEqual(store.ids(), [1, 2, 3])
+        self.assertEqual(store.get(1), "Diverticulitis")
+        self.assertEqual(store.get(3), "Pancreatitis")
+        self.assertIsNone(store.get(4))
+        self.assertNotIn(4, store)
+        self.assertEqual(
+            store.load_all(),
+            {1: "Diverticulitis", 2: "Cholecystitis", 3: "Pancreatitis"},
+        )
+        # Still readable without the store
+        self.assertEqual(len(list(read_from_pickle_file(self.results_path))), 3)
+
+    def test_index_existing_file(self):
+        append_to_pickle_file(self.results_path, {1: "Appendicitis"})
+        append_to_pickle_file(self.results_path, {2: "Cholecystitis"})
+
+        store = build_index(self.results_path)
+        self.assertTrue(os.path.exists(self.results_path + ".idx"))
+        self.assertEqual(store.get(2), "Cholecystitis")
+
+        # Records appended without the store are picked up
+        append_to_pickle_file(self.results_path, {3: "Pancreatitis"})
+        self.assertEqual(store.get(3), "Pancreatitis")
+        self.assertEqual(ResultsStore(self.results_path).ids(), [1, 2, 3])
+
+    def test_read_does_not_write(self):
+        append_to_pickle_file(self.results_path, {1: "Appendicitis"})
+        append_to_pickle_file(self.results_path, {2: "Cholecystitis"})
+
+        store = ResultsStore(self.results_path)
+        self.assertEqual(store.get(2), "Cholecystitis")
+        self.assertNotIn(3, store)
+        self.assertEqual(store.ids(), [1, 2])
+        self.assertEqual(os.listdir(self.tmp_dir.name), ["results.pkl"])
+
+        # The records indexed in memory are written to the index by the next append
+        store.append({3: "Pancreatitis"})
+        with open(self.results_path + ".idx") as f:
+            self.assertEqual(len(f.readlines()), 3)
+        self.assertEqual(ResultsStore(self.results_path).get(1), "Appendicitis")
+
+    def test_ids_survive_index(self):
+        store = ResultsStore(self.results_path)
+        store.append({"12345": "Appendicitis", 6789: "Cholecystitis"})
+
+        store = ResultsStore(self.results_path)
+        self.assertEqual(store.ids(), ["12345", 6789])
+        self.assertEqual(store.get("12345"), "Appendicitis")
+        self.assertIsNone(store.get("6789"))
+        with self.assertRaises(TypeError):
+            store.append({(1, 2): "Pancreatitis"})
+
+    def test_rebuild_stale_index(self):
+        store = ResultsStore(self.results_path)
+        store.append({1: "Appendicitis"})
+        store.append({2: "Cholecystitis"})
+
+        # Results file replaced by a shorter one
+        os.remove(self.results_path)
+        append_to_pickle_file(self.results_path, {3: "Pancreatitis"})
+        store = ResultsStore(self.results_path)
+        self.assertEqual(store.ids(), [3])
+        self.assertEqual(store.get(3), "Pancreatitis")
+
+        # The next append replaces the stale index
+        store.append({4: "Diverticulitis"})
+        self.assertEqual(ResultsStore(self.results_path).ids(), [3, 4])
+
+    def test_append_after_truncated_record(self):
+        store = ResultsStore(self.results_path)
+        store.append({1: "Appendicitis"})
+        record = pickle.dumps({2: "Cholecystitis"})
+        with open(self.results_path, "ab") as f:
+            f.write(record[: len(record) // 2])
+
+        store = ResultsStore(self.results_path)
+        store.append({3: "Pancreatitis"})
+        self.assertEqual(store.ids(), [1, 3])
+        self.assertEqual(
+            list(read_from_pickle_file(self.results_path)),
+            [{1: "Appendicitis"}, {3: "Pancreatitis"}],
+        )
+
+    def test_merge_indexed_shards(self):
+        shard_paths = [
+            os.path.join(self.tmp_dir.name, f"results_shard{i}of2.pkl")
+            for i in range(2)
+        ]
+        append_results(shard_paths[0], [1, 3])
+        append_results(shard_paths[1], [2, 3])
+        ResultsStore(self.results_path).append({1: "Diagnosis 1"})
+
+        self.assertEqual(merge_pickle_files(shard_paths, self.results_path), 2)
+
+        # Same cleanup as infer.launch_shards
+        for shard_path in shard_paths:
+            for path in [shard_path, shard_path + ".idx"]:
+                os.remove(path)
+        self.assertEqual(
+            sorted(os.listdir(self.tmp_dir.name)), ["results.pkl", "results.pkl.idx"]
+        )
+
+        # The index of the merged file covers all merged records
+        store = ResultsStore(self.results_path)
+        store._read_index(os.path.getsize(self.results_path))
+        self.assertEqual(store.indexed_end, os.path.getsize(self.results_path))
+        self.assertEqual(store.ids(), [1, 3, 2])
+        self.assertEqual(store.get(2), "Diagnosis 2")
+
+    def test_concurrent_appends(self):
+        workers = [
+            multiprocessing.Process(
+                target=append_results,
+                args=(self.results_path, range(shard * 50, (shard + 1) * 50)),
+            )
+            for shard in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        store = ResultsStore(self.results_path)
+        self.assertEqual(sorted(store.ids()), list(range(200)))
+        for _id in range(0, 200, 17):
+            self.assertEqual(store.get(_id), f"Diagnosis {_id}")
+        self.assertEqual(len(list(read_from_pickle_file(self.results_path))), 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import random
+import unittest
+
+import torch
+
+from models.utils import KeywordsStoppingCriteria, StopSequenceMatcher
+
+
+def ends_with_keyword(ids, keywords):
+    return any(len(k) > 0 and ids[-len(k) :] == k for k in keywords)
+
+
+class TestStopCriteria(unittest.TestCase):
+    def setUp(self):
+        self.keywords = [[5, 6], [6, 7, 8], [7], [3, 5, 6, 9]]
+        self.stop_criteria = KeywordsStoppingCriteria(
+            [torch.tensor(k) for k in self.keywords]
+        )
+
+    def test_matcher_agrees_with_suffix_check(self):
+        matcher = StopSequenceMatcher(self.keywords)
+        random.seed(2023)
+        tokens = [random.randint(3, 9) for _ in range(500)]
+        state = 0
+        for i, token in enumerate(tokens):
+            state = matcher.step(state, token)
+            self.assertEqual(
+                matcher.terminal[state],
+                ends_with_keyword(tokens[: i + 1], self.keywords),
+            )
+
+    def test_rows_are_independent(self):
+        rows = [[1, 2, 3, 4], [1, 2, 3, 5], [1, 2, 6, 7]]
+        self.assertEqual(
+            self.stop_criteria(torch.tensor(rows), None).tolist(),
+            [False, False, True],
+        )
+
+        rows = [row + [token] for row, token in zip(rows, [5, 6, 0])]
+        self.assertEqual(
+            self.stop_criteria(torch.tensor(rows), None).tolist(),
+            [False, True, True],
+        )
+
+        rows = [row + [token] for row, token in zip(rows, [6, 0, 0])]
+        self.assertEqual(
+            self.stop_criteria(torch.tensor(rows), None).tolist(),
+            [True, True, True],
+        )
+
+    def test_incremental_calls_match_full_check(self):
+        random.seed(2023)
+        ids = [random.randint(3, 9) for _ in range(10)]
+        for _ in range(200):
+            ids.append(random.randint(3, 9))
+            self.assertEqual(
+                bool(self.stop_criteria(torch.tensor([ids]), None)),
+                ends_with_keyword(ids, self.keywords),
+            )
+            if ends_with_keyword(ids, self.keywords):
+                # Start a new sequence after every stop
+                ids = [random.randint(3, 9) for _ in range(10)]
+
+    def test_reuse_for_new_sequence(self):
+        self.assertTrue(self.stop_criteria(torch.tensor([[1, 2, 5, 6]]), None))
+        self.assertFalse(self.stop_criteria(torch.tensor([[1, 2, 5, 4, 4]]), None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+from agents.prompts import FULL_INFO_TEMPLATE
+from utils.nlp import TokenBudget, calculate_num_tokens
+
+
+# Character tokenizer that adds a BOS token, so that token counts of sections add up exactly
+class CharTokenizer:
+    def encode(self, text, **kwargs):
+        return [0] + [ord(character) for character in text]
+
+
+class TestTokenBudget(unittest.TestCase):
+    def setUp(self):
+        self.tokenizer = CharTokenizer()
+        self.tags = {
+            "system_tag_start": "<|im_start|>system",
+            "system_tag_end": "<|im_end|>",
+            "user_tag_start": "<|im_start|>user",
+            "user_tag_end": "<|im_end|>",
+            "ai_tag_start": "<|im_start|>assistant",
+            "ai_tag_end": "<|im_end|>",
+        }
+        self.sections = {
+            "fewshot_examples": "Example patient with appendicitis.",
+            "diagnostic_criteria": "",
+            "input": "Patient History:\nRLQ pain since two days.",
+        }
+
+    def test_matches_full_prompt(self):
+        token_budget = TokenBudget(self.tokenizer, FULL_INFO_TEMPLATE, self.tags)
+        section_tokens = [
+            token_budget.count_section(field, text, static=field == "fewshot_examples")
+            for field, text in self.sections.items()
+        ]
+
+        full_prompt = FULL_INFO_TEMPLATE.format(**self.tags, **self.sections)
+        self.assertEqual(
+            token_budget.total(*section_tokens),
+            calculate_num_tokens(self.tokenizer, [full_prompt])
+            + token_budget.boundary_slack * 2,
+        )
+
+    def test_sections_outside_template_not_counted(self):
+        token_budget = TokenBudget(self.tokenizer, FULL_INFO_TEMPLATE, self.tags)
+        self.assertEqual(
+            token_budget.count_section("past_diagnosis_results", "Appendicitis"), 0
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
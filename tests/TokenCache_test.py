@@ -0,0 +1,80 @@
+import gc
+import unittest
+
+import utils.nlp as nlp
+from utils.nlp import (
+    TokenCache,
+    calculate_num_tokens,
+    truncate_text,
+    get_token_cache,
+    token_cache_stats,
+)
+
+
+# Whitespace tokenizer that counts how often it encodes
+class FakeTokenizer:
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text, **kwargs):
+        self.calls += 1
+        return [len(word) for word in text.split()]
+
+    def decode(self, ids, skip_special_tokens=False):
+        return " ".join("x" * i for i in ids)
+
+
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.tokenizer = FakeTokenizer()
+
+    def test_prompt_encoded_once(self):
+        prompt = "a bb ccc dddd"
+        self.assertEqual(calculate_num_tokens(self.tokenizer, [prompt]), 4)
+        self.assertEqual(calculate_num_tokens(self.tokenizer, [prompt, prompt]), 8)
+        self.assertEqual(truncate_text(self.tokenizer, prompt, 2), "x xx")
+        self.assertEqual(self.tokenizer.calls, 1)
+        self.assertEqual(
+            get_token_cache(self.tokenizer).stats(),
+            {
+                "hits": 3,
+                "misses": 1,
+                "entries": 1,
+                "tokens": 4,
+                "max_tokens": 262144,
+            },
+        )
+
+    def test_encoding_arguments_are_part_of_the_key(self):
+        cache = TokenCache()
+        cache.encode(self.tokenizer, "a bb")
+        cache.encode(self.tokenizer, "a bb", encode_special_tokens=True)
+        cache.encode(self.tokenizer, "a bb", encode_special_tokens=True)
+        self.assertEqual(self.tokenizer.calls, 2)
+
+    def test_bounded_by_tokens(self):
+        cache = TokenCache(max_tokens=4)
+        for text in ["a b", "c d", "e", "a b"]:
+            cache.encode(self.tokenizer, text)
+        self.assertEqual(cache.stats()["tokens"], 3)
+        self.assertEqual(self.tokenizer.calls, 4)
+
+        # Texts longer than the cache are encoded but not kept
+        cache.encode(self.tokenizer, "a b c d e")
+        self.assertEqual(cache.stats()["entries"], 2)
+
+    def test_cache_per_tokenizer(self):
+        other_tokenizer = FakeTokenizer()
+        calculate_num_tokens(self.tokenizer, ["a bb"])
+        calculate_num_tokens(other_tokenizer, ["a bb"])
+        self.assertEqual(other_tokenizer.calls, 1)
+
+        num_caches = len(nlp._token_caches)
+        del other_tokenizer
+        gc.collect()
+        self.assertEqual(len(nlp._token_caches), num_caches - 1)
+        self.assertGreaterEqual(token_cache_stats()["misses"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
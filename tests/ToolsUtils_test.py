@@ -0,0 +1,100 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from tools.utils import (
+    itemid_to_field,
+    get_itemid_index,
+    count_matches,
+    MODALITY_MATCHER,
+    REGION_MATCHER,
+    MODALITY_EXACT_DICT,
+    MODALITY_SUBSTR_DICT,
+    MODALITY_SPECIAL_CASES_DICT,
+    REGION_EXACT_DICT,
+    REGION_SUBSTR_DICT,
+)
+
+RADIOLOGY_EXAMS = [
+    "CT Abdomen with contrast",
+    "CT ABD & PELVIS W/O CONTRAST",
+    "CTA abdomen",
+    "Ultrasound of the right upper quadrant",
+    "US abd limited",
+    "Doppler ultrasound liver",
+    "MRI T2 pelvis",
+    "MRCP",
+    "ERCP",
+    "HIDA scan",
+    "Portable chest x-ray",
+    "x-ray KUB",
+    "abdomen abdomen abdomen",
+    "no imaging requested",
+]
+
+
+class TestToolsUtils(unittest.TestCase):
+    def setUp(self):
+        self.lab_test_mapping_df = pd.DataFrame(
+            {
+                "itemid": [51301, 50889, np.nan, 51301, 90201],
+                "label": [
+                    "White Blood Cells",
+                    "C-Reactive Protein",
+                    "Complete Blood Count (CBC)",
+                    "White Blood Cells Duplicate",
+                    "Blood Culture",
+                ],
+                "fluid": ["Blood", "Blood", "Blood", "Urine", np.nan],
+            }
+        )
+
+    def test_itemid_to_field_matches_mask_lookup(self):
+        df = self.lab_test_mapping_df
+        for itemid in [51301, 50889, 90201]:
+            for field in ["label", "fluid"]:
+                expected = df.loc[df["itemid"] == itemid, field].iloc[0]
+                value = itemid_to_field(itemid, field, df)
+                if expected != expected:
+                    self.assertTrue(value != value)
+                else:
+                    self.assertEqual(value, expected)
+
+    def test_itemid_to_field_missing(self):
+        with self.assertRaises(IndexError):
+            itemid_to_field(12345, "label", self.lab_test_mapping_df)
+
+    def test_itemid_index_built_once_per_dataframe(self):
+        index = get_itemid_index("label", self.lab_test_mapping_df)
+        self.assertIs(get_itemid_index("label", self.lab_test_mapping_df), index)
+
+        other_df = self.lab_test_mapping_df.copy()
+        other_df["label"] = other_df["label"].str.upper()
+        self.assertEqual(
+            itemid_to_field(51301, "label", other_df), "WHITE BLOOD CELLS"
+        )
+
+    def test_matchers_agree_with_count_matches(self):
+        for exam in RADIOLOGY_EXAMS:
+            self.assertEqual(
+                MODALITY_MATCHER.count(exam),
+                count_matches(
+                    exam,
+                    exact_dict=MODALITY_EXACT_DICT,
+                    substr_dict=MODALITY_SUBSTR_DICT,
+                    special_cases_dict=MODALITY_SPECIAL_CASES_DICT,
+                ),
+            )
+            self.assertEqual(
+                REGION_MATCHER.count(exam),
+                count_matches(
+                    exam,
+                    exact_dict=REGION_EXACT_DICT,
+                    substr_dict=REGION_SUBSTR_DICT,
+                ),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,5 @@
 from typing import Dict
+import weakref
 
 import pandas as pd
 import re
@@ -655,22 +656,112 @@ def count_matches(
     return counts
 
 
+def _alternation(patterns):
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns), re.IGNORECASE)
+
+
+# Same counts as count_matches for a fixed set of dictionaries, but all patterns are compiled once. Exact words are matched by a single alternation, substring and special case patterns are only run if a combined prefilter finds any of them
+class MatchCounter:
+    def __init__(
+        self, exact_dict: Dict = {}, substr_dict: Dict = {}, special_cases_dict: Dict = {}
+    ):
+        special_patterns = [
+            pattern for patterns in special_cases_dict.values() for pattern in patterns
+        ]
+        self.special_cases_prefilter = (
+            _alternation(special_patterns) if special_patterns else None
+        )
+        self.special_cases = [
+            (category, re.compile(pattern, re.IGNORECASE))
+            for category, patterns in special_cases_dict.items()
+            for pattern in patterns
+        ]
+
+        # Same category order as in count_matches
+        self.categories = list(set(list(exact_dict.keys()) + list(substr_dict.keys())))
+
+        # Plain words can only match whole words so every word in the text matches at most one of them. Words that are patterns themselves are counted separately
+        word_categories = {}
+        self.exact_patterns = []
+        for category, words in exact_dict.items():
+            for word in words:
+                if re.escape(word) == word:
+                    word_categories.setdefault(word.lower(), []).append(category)
+                else:
+                    self.exact_patterns.append(
+                        (category, re.compile(r"\b" + word + r"\b", re.IGNORECASE))
+                    )
+        self.exact_word_categories = list(word_categories.values())
+        self.exact_words = (
+            re.compile(
+                r"\b(?:"
+                + "|".join(
+                    f"(?P<w{i}>{word})" for i, word in enumerate(word_categories)
+                )
+                + r")\b",
+                re.IGNORECASE,
+            )
+            if word_categories
+            else None
+        )
+
+        substr_patterns = [
+            pattern for patterns in substr_dict.values() for pattern in patterns
+        ]
+        self.substr_prefilter = (
+            _alternation(substr_patterns) if substr_patterns else None
+        )
+        self.substr_patterns = [
+            (category, re.compile(pattern, re.IGNORECASE))
+            for category, patterns in substr_dict.items()
+            for pattern in patterns
+        ]
+
+    def count(self, text):
+        # If there is a special cases match, return that
+        if self.special_cases_prefilter is not None and self.special_cases_prefilter.search(
+            text
+        ):
+            for category, pattern in self.special_cases:
+                if pattern.search(text):
+                    return {category: 1}
+
+        counts = {category: 0 for category in self.categories}
+
+        # Count exact matches
+        if self.exact_words is not None:
+            for match in self.exact_words.finditer(text):
+                for category in self.exact_word_categories[int(match.lastgroup[1:])]:
+                    counts[category] += 1
+        for category, pattern in self.exact_patterns:
+            counts[category] += len(pattern.findall(text))
+
+        # Count substring matches
+        if self.substr_prefilter is not None and self.substr_prefilter.search(text):
+            for category, pattern in self.substr_patterns:
+                counts[category] += len(pattern.findall(text))
+
+        return counts
+
+
+MODALITY_MATCHER = MatchCounter(
+    exact_dict=MODALITY_EXACT_DICT,
+    substr_dict=MODALITY_SUBSTR_DICT,
+    special_cases_dict=MODALITY_SPECIAL_CASES_DICT,
+)
+REGION_MATCHER = MatchCounter(
+    exact_dict=REGION_EXACT_DICT,
+    substr_dict=REGION_SUBSTR_DICT,
+)
+
+
 def count_radiology_modality_and_organ_matches(text):
-    modality_counts = count_matches(
-        text,
-        exact_dict=MODALITY_EXACT_DICT,
-        substr_dict=MODALITY_SUBSTR_DICT,
-        special_cases_dict=MODALITY_SPECIAL_CASES_DICT,
-    )
+    modality_counts = MODALITY_MATCHER.count(text)
     frequent_modality = max(modality_counts, key=modality_counts.get)
     frequent_modality_count = modality_counts[frequent_modality]
 
     # Count matches of each region
-    organ_counts = count_matches(
-        text,
-        exact_dict=REGION_EXACT_DICT,
-        substr_dict=REGION_SUBSTR_DICT,
-    )
+    organ_counts = REGION_MATCHER.count(text)
     frequent_region = max(organ_counts, key=organ_counts.get)
     frequent_region_count = organ_counts[frequent_region]
 
@@ -688,7 +779,41 @@ def count_radiology_modality_and_organ_matches(text):
     )
 
 
+# Structures derived from a mapping DataFrame (indexes, resolvers) are built once per DataFrame. Entries are dropped once their DataFrame is garbage collected
+_dataframe_caches = {}
+
+
+def cached_for_dataframe(df: pd.DataFrame, name: str, build):
+    key = id(df)
+    entry = _dataframe_caches.get(key)
+    if entry is None or entry[0]() is not df:
+        entry = (
+            weakref.ref(df, lambda _, key=key: _dataframe_caches.pop(key, None)),
+            {},
+        )
+        _dataframe_caches[key] = entry
+
+    cache = entry[1]
+    if name not in cache:
+        cache[name] = build(df)
+    return cache[name]
+
+
+# Itemid lookups per mapping DataFrame and field instead of scanning all rows of the mapping for every lookup
+def get_itemid_index(field: str, lab_test_mapping_df: pd.DataFrame) -> Dict:
+    def build(df):
+        index = {}
+        for itemid, value in zip(df["itemid"], df[field]):
+            # Rows without itemid are panels. First row of an itemid wins like in a mask lookup
+            if not pd.isna(itemid):
+                index.setdefault(itemid, value)
+        return index
+
+    return cached_for_dataframe(lab_test_mapping_df, f"itemid_{field}", build)
+
+
 def itemid_to_field(itemid: int, field: str, lab_test_mapping_df: pd.DataFrame):
-    return lab_test_mapping_df.loc[lab_test_mapping_df["itemid"] == itemid, field].iloc[
-        0
-    ]
+    index = get_itemid_index(field, lab_test_mapping_df)
+    if itemid not in index:
+        raise IndexError(f"Itemid {itemid} not found in lab test mapping")
+    return index[itemid]
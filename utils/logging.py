@@ -1,4 +1,5 @@
 import ast
+import os
 import pickle
 
 
@@ -52,3 +53,45 @@ def read_from_pickle_file(filename):
                 yield pickle.load(f)
             except EOFError:
                 break
+            except pickle.UnpicklingError:
+                # Last record was only partially written because the process was killed while logging
+                print(f"Skipping truncated record at end of {filename}")
+                break
+
+
+# Used for resuming runs. Collects the ids of all complete records and cuts off a partially written last record so that new records can be appended safely
+def load_completed_ids(filename, repair=True):
+    completed_ids = set()
+    if not os.path.exists(filename):
+        return completed_ids
+    with open(filename, "r+b") as f:
+        last_complete = 0
+        while True:
+            try:
+                record = pickle.load(f)
+            except (EOFError, pickle.UnpicklingError):
+                break
+            completed_ids.update(record.keys())
+            last_complete = f.tell()
+        if repair and last_complete < os.path.getsize(filename):
+            print(f"Removing truncated record at end of {filename}")
+            f.truncate(last_complete)
+    return completed_ids
+
+
+# Used for sharded runs. Appends the results of all shard files to the target file through its results store, skipping ids that are already in the target
+def merge_pickle_files(filenames, target_filename):
+    # utils.results_store builds on the pickle functions of this module
+    from utils.results_store import ResultsStore
+
+    target = ResultsStore(target_filename)
+    merged_ids = set(target.ids())
+    num_merged = 0
+    for filename in filenames:
+        for _id, result in ResultsStore(filename).load_all().items():
+            if _id in merged_ids:
+                continue
+            target.append({_id: result})
+            merged_ids.add(_id)
+            num_merged += 1
+    return num_merged
@@ -1,30 +1,222 @@
-import logging
 from typing import List
 import string
 import copy
+import hashlib
+import sys
+import weakref
+from collections import OrderedDict
 
 import pandas as pd
-import spacy
-from negspacy.negation import Negex  # noqa: F401
-import nltk
 import re
-from thefuzz import process, fuzz
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-from transformers import LlamaTokenizer,PreTrainedTokenizerFast
-from exllamav2 import ExLlamaV2Tokenizer
-import tiktoken
-
-from tools.utils import FLUID_MAPPING, itemid_to_field
-
-nlp = spacy.load("en_core_sci_lg")
-nlp.add_pipe(
-    "negex",
-    config={
-        "chunk_prefix": ["no"],
-    },
-    last=True,
+from rapidfuzz import process as rapidfuzz_process, fuzz as rapidfuzz_fuzz
+from rapidfuzz.utils import default_process
+
+from tools.utils import (
+    FLUID_MAPPING,
+    itemid_to_field,
+    get_itemid_index,
+    cached_for_dataframe,
 )
+
+# The spaCy pipeline takes several seconds and hundreds of MB to load so it is only loaded on first use
+_nlp = None
+
+
+def get_nlp():
+    global _nlp
+    if _nlp is None:
+        import spacy
+        from negspacy.negation import Negex  # noqa: F401
+
+        _nlp = spacy.load("en_core_sci_lg")
+        _nlp.add_pipe(
+            "negex",
+            config={
+                "chunk_prefix": ["no"],
+            },
+            last=True,
+        )
+    return _nlp
+
+
+# Keep "from utils.nlp import nlp" working
+def __getattr__(name):
+    if name == "nlp":
+        return get_nlp()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Parsing a sentence with the pipeline is the most expensive part of scoring. The same sentences are checked for many different keywords so we keep the parsed docs of the most recently used sentences
+class DocCache:
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.docs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _put(self, text, doc):
+        self.docs[text] = doc
+        self.docs.move_to_end(text)
+        while len(self.docs) > self.maxsize:
+            self.docs.popitem(last=False)
+
+    def get(self, text):
+        doc = self.docs.get(text)
+        if doc is not None:
+            self.docs.move_to_end(text)
+            self.hits += 1
+            return doc
+        self.misses += 1
+        doc = get_nlp()(text)
+        self._put(text, doc)
+        return doc
+
+    def pipe(self, texts, batch_size=64):
+        # Parse all sentences that are not cached yet in a single batched pass through the pipeline
+        docs = {}
+        missing = []
+        for text in dict.fromkeys(texts):
+            doc = self.docs.get(text)
+            if doc is not None:
+                self.docs.move_to_end(text)
+                docs[text] = doc
+            else:
+                missing.append(text)
+        for text, doc in zip(missing, get_nlp().pipe(missing, batch_size=batch_size)):
+            self._put(text, doc)
+            docs[text] = doc
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return [docs[text] for text in texts]
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.docs),
+            "maxsize": self.maxsize,
+        }
+
+    def clear(self):
+        self.docs.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+doc_cache = DocCache()
+
+
+def parse_sentence(sentence):
+    return doc_cache.get(sentence)
+
+
+def parse_sentences(sentences, batch_size=64):
+    return doc_cache.pipe(list(sentences), batch_size=batch_size)
+
+
+def doc_cache_stats():
+    return doc_cache.stats()
+
+
+# The tokenizer libraries are heavy to import. A tokenizer can only be an instance of their classes if they were already imported by whoever created it
+def is_exllama_tokenizer(tokenizer):
+    exllamav2 = sys.modules.get("exllamav2")
+    return exllamav2 is not None and isinstance(tokenizer, exllamav2.ExLlamaV2Tokenizer)
+
+
+def is_tiktoken_tokenizer(tokenizer):
+    tiktoken = sys.modules.get("tiktoken")
+    return tiktoken is not None and isinstance(tokenizer, tiktoken.Encoding)
+
+
+# Prompts are tokenized several times for counting, truncation and generation (e.g. the agent counts its full prompt before calling the model). We keep the token ids of the most recently encoded texts, keyed by a hash of the text so that long prompts are not stored twice. The cache is bounded by the number of tokens it holds. The cached ids are shared and must not be modified
+class TokenCache:
+    def __init__(self, max_tokens=262144):
+        self.max_tokens = max_tokens
+        self.ids = OrderedDict()
+        self.tokens = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def num_tokens(ids):
+        return ids.shape[-1] if hasattr(ids, "shape") else len(ids)
+
+    def encode(self, tokenizer, text, **kwargs):
+        key = (
+            hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest(),
+            tuple(sorted(kwargs.items())),
+        )
+        ids = self.ids.get(key)
+        if ids is not None:
+            self.ids.move_to_end(key)
+            self.hits += 1
+            return ids
+        self.misses += 1
+        ids = tokenizer.encode(text, **kwargs)
+        num_tokens = self.num_tokens(ids)
+        # Texts longer than the whole cache are not kept
+        if num_tokens > self.max_tokens:
+            return ids
+        self.ids[key] = ids
+        self.tokens += num_tokens
+        while self.tokens > self.max_tokens:
+            _, evicted = self.ids.popitem(last=False)
+            self.tokens -= self.num_tokens(evicted)
+        return ids
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.ids),
+            "tokens": self.tokens,
+            "max_tokens": self.max_tokens,
+        }
+
+    def clear(self):
+        self.ids.clear()
+        self.tokens = 0
+        self.hits = 0
+        self.misses = 0
+
+
+# One cache per tokenizer that is dropped together with the tokenizer
+_token_caches = weakref.WeakKeyDictionary()
+
+
+def get_token_cache(tokenizer):
+    try:
+        cache = _token_caches.get(tokenizer)
+        if cache is None:
+            cache = _token_caches[tokenizer] = TokenCache()
+    except TypeError:
+        # Tokenizers that can not be weakly referenced are not cached
+        cache = TokenCache(max_tokens=0)
+    return cache
+
+
+# Arguments the models encode their prompts with. Counting and truncation use the same ones so that they share the cached ids with generation
+def prompt_encode_kwargs(tokenizer):
+    if is_exllama_tokenizer(tokenizer):
+        return {"encode_special_tokens": True}
+    return {}
+
+
+def encode_cached(tokenizer, text):
+    return get_token_cache(tokenizer).encode(
+        tokenizer, text, **prompt_encode_kwargs(tokenizer)
+    )
+
+
+def token_cache_stats():
+    stats = {"hits": 0, "misses": 0, "entries": 0, "tokens": 0}
+    for cache in list(_token_caches.values()):
+        for field in stats:
+            stats[field] += cache.stats()[field]
+    return stats
+
+
 # nltk.download("stopwords")
 
 ###
@@ -33,6 +225,7 @@ nlp.add_pipe(
 
 
 def treatment_alternative_procedure_checker(operation_keywords, text):
+    parse_sentences(text.split("."))
     for alternative_operations in operation_keywords:
         op_loc = alternative_operations["location"]
         for op_mod in alternative_operations["modifiers"]:
@@ -46,7 +239,7 @@ def treatment_alternative_procedure_checker(operation_keywords, text):
 
 # Makes check if a keyword is positive i.e. occurs and is not negated. For negation check uses the negex algorithm i.e. "No appendicitis" or "No signs of appendicitis" or "Abscence of typical indications of appendicitis"
 def keyword_positive(sentence, keyword):
-    doc = nlp(sentence)
+    doc = parse_sentence(sentence)
 
     for e in doc.ents:
         if keyword.lower() in e.text.lower():
@@ -78,6 +271,13 @@ def procedure_checker(
     valid_procedures: List,
     done_procedures: List,
 ):
+    # All done procedures are checked against every keyword so parse them together once
+    if any(type(valid_procedure) != int for valid_procedure in valid_procedures):
+        parse_sentences(
+            done_procedure
+            for done_procedure in done_procedures
+            if isinstance(done_procedure, str)
+        )
     for valid_procedure in valid_procedures:
         if type(valid_procedure) == int:
             if valid_procedure in done_procedures:
@@ -90,6 +290,8 @@ def procedure_checker(
 
 # Extract keywords from text using spacy library. Keywords are nouns and adjectives
 def extract_keywords_spacy(text: str):
+    import spacy
+
     nlp = spacy.load("en_core_web_sm")
     doc = nlp(text)
     keywords = [token.text for token in doc if token.pos_ in ["NOUN", "ADJ", "PROPN"]]
@@ -98,6 +300,9 @@ def extract_keywords_spacy(text: str):
 
 # Extract keywords from text using nltk library. Keywords are nouns and adjectives
 def extract_keywords_nltk(text: str):
+    import nltk
+    from nltk.tokenize import word_tokenize
+
     words = word_tokenize(text)
     pos_tags = nltk.pos_tag(words)
     keywords = [word for word, tag in pos_tags if tag in ["NN", "NNS", "JJ", "NNP"]]
@@ -126,12 +331,57 @@ def match_fluid(test: str):
     return None, None
 
 
-# Convert list of tests to canonical names. Canonical names are the names used in the lab test mapping file
-def convert_labs_to_itemid(tests: List[str], lab_test_mapping_df: pd.DataFrame):
-    logging.getLogger().setLevel(logging.ERROR)
-    labels = lab_test_mapping_df["label"].tolist()
-    all_tests = []
-    for test_full in tests:
+# Resolves requested test names to the canonical names used in the lab test mapping file. Built once per mapping. Labels are normalized once and scored with rapidfuzz instead of normalizing all labels again for every fuzzy search
+class LabNameResolver:
+    def __init__(self, lab_test_mapping_df: pd.DataFrame):
+        self.labels = self._prepare_labels(lab_test_mapping_df["label"].tolist())
+        self.labels_by_fluid = {
+            fluid: self._prepare_labels(
+                lab_test_mapping_df[lab_test_mapping_df["fluid"] == fluid][
+                    "label"
+                ].tolist()
+            )
+            for fluid in FLUID_MAPPING
+        }
+        self.corresponding_ids = {}
+        for label, ids in zip(
+            lab_test_mapping_df["label"], lab_test_mapping_df["corresponding_ids"]
+        ):
+            self.corresponding_ids.setdefault(label, ids)
+        self.test_fluids = get_itemid_index("fluid", lab_test_mapping_df)
+        # Requested tests already resolved to their canonical name ("" if no match)
+        self.memo = {}
+
+    @staticmethod
+    def _prepare_labels(labels):
+        processed = [default_process(label) for label in labels]
+        exact = {}
+        for label, processed_label in zip(labels, processed):
+            exact.setdefault(processed_label, label)
+        return labels, processed, exact
+
+    # Same result as thefuzz process.extractOne with the fuzz.ratio scorer
+    def extract_one(self, test, labels):
+        labels, processed, exact = labels
+        query = default_process(test)
+        # rapidfuzz scores two empty strings as identical while thefuzz scores them 0, so names without letters or digits never match
+        if not query:
+            return "", 0
+        # A perfect score is only reached by identical strings so the first identical label is the best match
+        if query in exact:
+            return exact[query], 100
+        match = rapidfuzz_process.extractOne(
+            query, processed, scorer=rapidfuzz_fuzz.ratio, processor=None
+        )
+        if match is None:
+            return "", 0
+        _, score, index = match
+        return labels[index], int(round(score))
+
+    def resolve(self, test_full):
+        if test_full in self.memo:
+            return self.memo[test_full]
+
         fluid, test_no_fluid = match_fluid(test_full)
 
         # Extract short and long name
@@ -139,60 +389,69 @@ def convert_labs_to_itemid(tests: List[str], lab_test_mapping_df: pd.DataFrame):
 
         # Try fuzzy matching to allow for spelling mistakes and small discrepencies. Use ratio because we have many tests that are just one letter that match too strong with partial ratio
         # Start with full name since its hardest to match and has least amount of false positives
-        test_match, score = process.extractOne(test_full, labels, scorer=fuzz.ratio)
+        test_match, score = self.extract_one(test_full, self.labels)
         if score < 90:
             # If no match, try using the long name.
-            test_match, score = process.extractOne(test_long, labels, scorer=fuzz.ratio)
+            test_match, score = self.extract_one(test_long, self.labels)
             if score < 90:
                 # If no match, try using the short name but look for exact match because a single letter difference typically completely changes the test
-                test_match, score = process.extractOne(
-                    test_short, labels, scorer=fuzz.ratio
-                )
+                test_match, score = self.extract_one(test_short, self.labels)
                 if score < 100:
                     # If no match, try removing the fluid and searching again
                     if fluid:
-                        labels_fluid = lab_test_mapping_df[
-                            lab_test_mapping_df["fluid"] == fluid
-                        ]["label"].tolist()
-                        test_match, score = process.extractOne(
-                            test_no_fluid, labels_fluid, scorer=fuzz.ratio
+                        test_match, score = self.extract_one(
+                            test_no_fluid, self.labels_by_fluid[fluid]
                         )
                         if score < 90:
                             # Finally, return just test itself. Will not match going forward but saves original intent
                             test_match = ""
-                            with open("no_canonical_names.txt", "a") as f:
-                                f.write(f"{test_full}\n")
                     else:
                         # Finally, return just test itself. Will not match going forward but saves original intent
                         test_match = ""
-                        with open("no_canonical_names.txt", "a") as f:
-                            f.write(f"{test_full}\n")
-
-        # Replace test with full list of valid names if matched
-        if test_match:
-            expanded_tests = lab_test_mapping_df.loc[
-                lab_test_mapping_df["label"] == test_match, "corresponding_ids"
-            ].iloc[0]
-
-            # Only include those of specific fluid if specified
-            if fluid:
-                expanded_tests = [
-                    test
-                    for test in expanded_tests
-                    if (itemid_to_field(test, "fluid", lab_test_mapping_df) == fluid)
-                    or (  # If fluid is nan then its a microbio test. TODO: Check against spec_itemid instead
-                        itemid_to_field(test, "fluid", lab_test_mapping_df)
-                        != itemid_to_field(test, "fluid", lab_test_mapping_df)
-                    )
-                ]
-            all_tests.extend(expanded_tests)
-        else:
-            all_tests.append(test_full)
-    logging.getLogger().setLevel(logging.INFO)
-    return all_tests
+
+        self.memo[test_full] = test_match
+        return test_match
+
+    def convert(self, tests: List[str]):
+        all_tests = []
+        for test_full in tests:
+            test_match = self.resolve(test_full)
+
+            # Replace test with full list of valid names if matched
+            if test_match:
+                expanded_tests = self.corresponding_ids[test_match]
+
+                # Only include those of specific fluid if specified
+                fluid, _ = match_fluid(test_full)
+                if fluid:
+                    expanded_tests = [
+                        test
+                        for test in expanded_tests
+                        if (self.test_fluids[test] == fluid)
+                        or (  # If fluid is nan then its a microbio test. TODO: Check against spec_itemid instead
+                            self.test_fluids[test] != self.test_fluids[test]
+                        )
+                    ]
+                all_tests.extend(expanded_tests)
+            else:
+                with open("no_canonical_names.txt", "a") as f:
+                    f.write(f"{test_full}\n")
+                all_tests.append(test_full)
+        return all_tests
+
+
+def get_lab_name_resolver(lab_test_mapping_df: pd.DataFrame):
+    return cached_for_dataframe(lab_test_mapping_df, "lab_name_resolver", LabNameResolver)
+
+
+# Convert list of tests to canonical names. Canonical names are the names used in the lab test mapping file
+def convert_labs_to_itemid(tests: List[str], lab_test_mapping_df: pd.DataFrame):
+    return get_lab_name_resolver(lab_test_mapping_df).convert(tests)
 
 
 def remove_stop_words(sentence):
+    from nltk.corpus import stopwords
+
     nltk_stop_words = set(stopwords.words("english"))
 
     # Keep uppercase single letters as they often are part of lab tests
@@ -264,6 +523,7 @@ def extract_sections(text, tags_list):
 # Text parses differently if done line by line and as a whole. This function extracts the first diagnosis from the text by checking both
 def extract_primary_diagnosis(text):
     earliest_keyword_index = len(text)
+    nlp = get_nlp()
 
     # Do parsing of entire text and check for earliest possible diagnosis
     doc = nlp(text)
@@ -334,8 +594,8 @@ def check_ents_for_diagnosis_noun_chunks(doc):
 def calculate_num_tokens(tokenizer, inputs):
     num_tokens = 0
     for input in inputs:
-        tokens = tokenizer.encode(input)
-        if isinstance(tokenizer, ExLlamaV2Tokenizer):
+        tokens = encode_cached(tokenizer, input)
+        if is_exllama_tokenizer(tokenizer):
             num_tokens += tokens.shape[-1]
         else:
             num_tokens += len(tokens)
@@ -343,22 +603,76 @@ def calculate_num_tokens(tokenizer, inputs):
 
 
 def truncate_text(tokenizer, input, available_tokens):
-    if isinstance(tokenizer, ExLlamaV2Tokenizer):
-        truncated_input_tokens = tokenizer.encode(input)[:, :available_tokens]
-        input = tokenizer.decode(truncated_input_tokens)[0]
-    elif isinstance(tokenizer, tiktoken.Encoding):
-        truncated_input_tokens = input = tokenizer.encode(input)[:available_tokens]
+    if is_exllama_tokenizer(tokenizer):
+        truncated_input_tokens = encode_cached(tokenizer, input)[:, :available_tokens]
+        input = tokenizer.decode(truncated_input_tokens, decode_special_tokens=True)[0]
+    elif is_tiktoken_tokenizer(tokenizer):
+        truncated_input_tokens = encode_cached(tokenizer, input)[:available_tokens]
         input = tokenizer.decode(truncated_input_tokens)
     else:
-        truncated_tokens = tokenizer.encode(
-            input,
-            truncation=False,
-            padding=False,
-        )[:available_tokens]
+        # Same as encoding without truncation and padding
+        truncated_tokens = encode_cached(tokenizer, input)[:available_tokens]
         input = tokenizer.decode(truncated_tokens, skip_special_tokens=True)
     return input
 
 
+# Keeps track of the token count of a prompt by counting each section of the prompt (template skeleton, patient information, imaging, fewshot examples, ...) separately so that changing one section does not require re-tokenizing the whole prompt
+class TokenBudget:
+    def __init__(self, tokenizer, prompt_template, tags, boundary_slack=1):
+        self.tokenizer = tokenizer
+        self.prompt_template = prompt_template
+        self.tags = tags
+        # Tokens at the borders of two sections can merge differently than when counted separately, so we budget a small slack per section to stay on the safe side
+        self.boundary_slack = boundary_slack
+        self.fields = {
+            field
+            for _, field, _, _ in string.Formatter().parse(prompt_template)
+            if field
+        }
+        # Special tokens (e.g. BOS) that the tokenizer adds to every encoded text. Only counted once for the full prompt
+        self.special_tokens = calculate_num_tokens(tokenizer, [""])
+        # Sections that are the same for many patients (fewshot examples, guidelines) are kept for the whole run
+        self.static_counts = {}
+        self.patient_counts = {}
+        self.skeleton_tokens = calculate_num_tokens(
+            tokenizer,
+            [
+                prompt_template.format(
+                    **{
+                        **{field: "" for field in self.fields},
+                        **{tag: tags[tag] for tag in tags if tag in self.fields},
+                    }
+                )
+            ],
+        )
+
+    def reset(self):
+        self.patient_counts = {}
+
+    def count(self, text, static=False):
+        if not text:
+            return 0
+        counts = self.static_counts if static else self.patient_counts
+        if text not in counts:
+            counts[text] = (
+                calculate_num_tokens(self.tokenizer, [text]) - self.special_tokens
+            )
+        return counts[text]
+
+    def count_section(self, field, text, static=False):
+        # Sections that are not part of the template do not contribute to the prompt
+        if field not in self.fields:
+            return 0
+        return self.count(text, static=static)
+
+    def total(self, *section_tokens):
+        return (
+            self.skeleton_tokens
+            + sum(section_tokens)
+            + self.boundary_slack * sum(1 for tokens in section_tokens if tokens)
+        )
+
+
 def create_lab_test_string(
     test_id,
     lab_test_mapping_df,
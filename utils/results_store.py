@@ -0,0 +1,249 @@
+import fcntl
+import json
+import numbers
+import os
+import pickle
+import sys
+from contextlib import contextmanager
+
+from utils.logging import read_from_pickle_file
+
+
+def normalize_id(_id):
+    """
+    Ids of the index are stored as json. Integer ids of other types (i.e. numpy integers taken from a dataframe) are converted to int, ids that json can not restore are rejected.
+    """
+    if isinstance(_id, str):
+        return _id
+    if isinstance(_id, numbers.Integral) and not isinstance(_id, bool):
+        return int(_id)
+    raise TypeError(f"Result ids must be strings or integers, got {_id!r}")
+
+
+class ResultsStore:
+    """
+    Results file of a run with an offset index for random access to single patients.
+
+    The results file keeps the format written by append_to_pickle_file, back to back pickled dicts of {_id: result}, so files without an index can be read by the store and files written by the store can be read by read_from_pickle_file. The index is a sidecar file with one json line per record holding its ids and byte range. Records appended to the results file without the store are indexed the next time the store looks at the file, and the index is rebuilt if it does not fit the results file anymore.
+
+    Reading never writes. Without a usable index the records are indexed in memory only. Appends lock the results file so that several processes can write to the same store, and bring the index up to date.
+
+    Ids must be strings or integers so that they survive the json index.
+
+    Args:
+        path (str): Path of the results file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + ".idx"
+        # _id -> (offset, end) of the last record containing the id
+        self.positions = {}
+        # End of the records in positions
+        self.indexed_end = 0
+        # Bytes of the index file read so far and end of the records they cover
+        self.index_read = 0
+        self.index_end = 0
+        # False if the index file does not fit the results file. Reads then ignore it until an append rebuilds it
+        self.index_usable = True
+        # Records indexed in memory but not yet written to the index file
+        self.unwritten = []
+        # Size of the results file at the last refresh
+        self.seen_size = None
+
+    @contextmanager
+    def _locked(self, mode, lock):
+        with open(self.path, mode) as f:
+            fcntl.flock(f, lock)
+            try:
+                yield f
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _reset(self):
+        self.positions = {}
+        self.indexed_end = 0
+        self.index_read = 0
+        self.index_end = 0
+        self.unwritten = []
+        self.seen_size = None
+
+    def _add_entry(self, entry):
+        for _id in entry["ids"]:
+            self.positions[_id] = (entry["offset"], entry["end"])
+        self.indexed_end = max(self.indexed_end, entry["end"])
+
+    # Reads the index lines written since the last read, also by other processes. Returns False if the index does not fit the results file
+    def _read_index(self, size):
+        if not os.path.exists(self.index_path):
+            return self.index_read == 0
+        with open(self.index_path, "rb") as f:
+            f.seek(self.index_read)
+            for line in f:
+                # Line of an interrupted write
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    return False
+                if entry["offset"] != self.index_end or entry["end"] > size:
+                    return False
+                self._add_entry(entry)
+                self.index_read += len(line)
+                self.index_end = entry["end"]
+        self.unwritten = [
+            entry for entry in self.unwritten if entry["offset"] >= self.index_end
+        ]
+        return True
+
+    def _write_entries(self, entries):
+        with open(self.index_path, "ab") as f:
+            # Cut off a partially written line of an interrupted write
+            if f.tell() > self.index_read:
+                f.truncate(self.index_read)
+            for entry in entries:
+                line = (json.dumps(entry) + "\n").encode()
+                f.write(line)
+                self.index_read += len(line)
+                self.index_end = entry["end"]
+
+    # Indexes the records after the indexed ones in memory. Must hold a lock on the results file
+    def _scan(self, size):
+        with open(self.path, "rb") as f:
+            f.seek(self.indexed_end)
+            offset = self.indexed_end
+            while offset < size:
+                try:
+                    record = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError):
+                    break
+                entry = {
+                    "ids": [normalize_id(_id) for _id in record],
+                    "offset": offset,
+                    "end": f.tell(),
+                }
+                self._add_entry(entry)
+                self.unwritten.append(entry)
+                offset = entry["end"]
+
+    def refresh(self):
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        # Nothing was appended since the last look at the file
+        if size == self.seen_size:
+            return
+        if self.index_usable and not self._read_index(size):
+            self.index_usable = False
+            self._reset()
+        if self.indexed_end > size:
+            self._reset()
+        if self.indexed_end < size:
+            with self._locked("rb", fcntl.LOCK_SH):
+                self._scan(size)
+        self.seen_size = size
+
+    def append(self, record):
+        """
+        Append a record of {_id: result} to the results file and the index.
+
+        Args:
+            record (Dict): Results of one or more patients
+        """
+        ids = [normalize_id(_id) for _id in record]
+        with self._locked("ab", fcntl.LOCK_EX) as f:
+            # Bring the index file up to date with the results file before adding to it
+            size = os.path.getsize(self.path)
+            if not self._read_index(size) or self.indexed_end > size:
+                self._reset()
+                if os.path.exists(self.index_path):
+                    os.remove(self.index_path)
+            self.index_usable = True
+            self._scan(size)
+            if self.unwritten:
+                self._write_entries(self.unwritten)
+                self.unwritten = []
+
+            # Remove a partially written last record of a killed process so that the new record can be read
+            if f.tell() > self.indexed_end:
+                print(f"Removing truncated record at end of {self.path}")
+                f.truncate(self.indexed_end)
+                f.seek(self.indexed_end)
+            offset = self.indexed_end
+            pickle.dump(record, f)
+            f.flush()
+            entry = {"ids": ids, "offset": offset, "end": f.tell()}
+            self._add_entry(entry)
+            self._write_entries([entry])
+
+    def __contains__(self, _id):
+        _id = normalize_id(_id)
+        if _id not in self.positions:
+            self.refresh()
+        return _id in self.positions
+
+    def get(self, _id, default=None):
+        """
+        Read the result of a single patient without reading the rest of the file.
+
+        Args:
+            _id: Id of the patient
+            default: Returned if the patient is not in the results file
+
+        Returns:
+            result: Last result written for the patient
+        """
+        if _id not in self:
+            return default
+        offset, _ = self.positions[normalize_id(_id)]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return pickle.load(f)[_id]
+
+    def ids(self):
+        """
+        Returns:
+            ids (List): Ids of all patients in the order they were first written
+        """
+        self.refresh()
+        return list(self.positions)
+
+    def load_all(self):
+        """
+        Returns:
+            results (Dict): All results of the file. Later records overwrite earlier ones
+        """
+        results = {}
+        if not os.path.exists(self.path):
+            return results
+        for record in read_from_pickle_file(self.path):
+            results.update(record)
+        return results
+
+
+def build_index(path):
+    """
+    Index an existing results file written with append_to_pickle_file. An existing index is rebuilt from scratch.
+
+    Args:
+        path (str): Path of the results file
+
+    Returns:
+        store (ResultsStore): Store of the indexed file
+    """
+    store = ResultsStore(path)
+    with store._locked("ab", fcntl.LOCK_EX):
+        if os.path.exists(store.index_path):
+            os.remove(store.index_path)
+        store._scan(os.path.getsize(path))
+        store._write_entries(store.unwritten)
+        store.unwritten = []
+    return store
+
+
+if __name__ == "__main__":
+    # Index the results files given on the command line
+    for path in sys.argv[1:]:
+        store = build_index(path)
+        print(f"Indexed {len(store.positions)} patients of {path}")